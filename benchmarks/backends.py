@@ -0,0 +1,52 @@
+# Frames/sec of the eager torch generator vs. the ONNX Runtime CPU backend on a frame sequence.
+# Run from the repository root:
+#   python -m benchmarks.backends data/Lili/checkpoints checkpoint_best.pth --input_dir data/Lili/input
+from argparse import ArgumentParser
+import time
+
+import torch
+
+from evaluate import load_config, load_generator, make_resize, prepare_input, InferDataset
+from futscml import *
+
+
+def frames_per_second(model, frames, warmup=3):
+    with torch.no_grad():
+        for frame in frames[:warmup]:
+            model(frame)
+        begin = time.perf_counter()
+        for frame in frames:
+            model(frame)
+        return len(frames) / (time.perf_counter() - begin)
+
+
+if __name__ == "__main__":
+    p = ArgumentParser()
+    p.add_argument('checkpoint_dir', type=str)
+    p.add_argument('checkpoint_filename', type=str)
+    p.add_argument('--input_dir', default='data/Lili/input', type=str)
+    p.add_argument('--onnx_path', default=None, type=str, help='Defaults to <checkpoint>.onnx, see export.py')
+    p.add_argument('--threads', default=[0], type=int, nargs='+',
+                   help='Thread counts to try, 0 = library default')
+    p.add_argument('--max_frames', default=50, type=int)
+    argds = p.parse_args()
+
+    config = load_config(argds.checkpoint_dir)
+    config['device'] = 'cpu'
+    checkpoint = os.path.join(argds.checkpoint_dir, argds.checkpoint_filename)
+    onnx_path = argds.onnx_path if argds.onnx_path is not None else os.path.splitext(checkpoint)[0] + '.onnx'
+
+    dataset = InferDataset(argds.input_dir, make_resize(config))
+    frames = [prepare_input(dataset[i][0].unsqueeze(0), config) for i in range(min(len(dataset), argds.max_frames))]
+    print(f"{len(frames)} frames of {tuple(frames[0].shape[-2:])} from {argds.input_dir}")
+
+    model = load_generator(config, checkpoint)
+    default_threads = torch.get_num_threads()
+    print(f"{'backend':<14}{'threads':>8}{'frames/s':>10}")
+    for threads in argds.threads:
+        torch.set_num_threads(threads if threads > 0 else default_threads)
+        fps = frames_per_second(model, frames)
+        print(f"{'torch':<14}{threads:>8}{fps:>10.2f}")
+        fps = frames_per_second(OnnxRuntimeModel(onnx_path, intra_op_threads=threads), frames)
+        print(f"{'onnxruntime':<14}{threads:>8}{fps:>10.2f}")
+    torch.set_num_threads(default_threads)
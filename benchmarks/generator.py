@@ -0,0 +1,128 @@
+# Latency/throughput of ImageToImageGenerator_JohnsonFutschik over a matrix of model configs, resolutions,
+# batch sizes, thread counts, precisions and modes, with an optional comparison against a stored baseline.
+# Run from the repository root:
+#   python -m benchmarks.generator --device cpu --output bench.json
+#   python -m benchmarks.generator --device cpu --baseline bench.json --tolerance 0.1
+# Modes: forward = training module in eval mode, frozen = freeze_for_inference as used by evaluate.py,
+# train = forward + backward of the training module.
+from argparse import ArgumentParser
+import glob
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import torch
+import yaml
+
+from futscml import *
+from generator import ImageToImageGenerator_JohnsonFutschik
+
+
+def parse_resolution(value):
+    # 512 or 512x288 (width x height)
+    w, _, h = value.partition('x')
+    return int(h or w), int(w)
+
+
+def build(config, mode, device):
+    torch.manual_seed(0)
+    model = ImageToImageGenerator_JohnsonFutschik(config=config, **config['model_params']).to(device)
+    if mode == 'train':
+        return model.train()
+    model.eval()
+    return freeze_for_inference(model) if mode == 'frozen' else model
+
+
+def time_case(model, x, mode, precision, warmup, repeats):
+    '''
+    Median milliseconds per call
+    '''
+    wrapped = PrecisionWrapper(model, precision)
+
+    def step():
+        if mode == 'train':
+            model.zero_grad(set_to_none=True)
+            wrapped(x).mean().backward()
+        else:
+            with torch.no_grad():
+                wrapped(x)
+        if x.is_cuda: torch.cuda.synchronize()
+
+    for _ in range(warmup):
+        step()
+    times = []
+    for _ in range(repeats):
+        begin = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - begin)
+    return float(np.median(times) * 1000)
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Cases slower than the baseline by more than tolerance (relative), as (key, baseline ms, ms)
+    '''
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline: continue
+        if result['ms'] > baseline[key]['ms'] * (1 + tolerance):
+            regressions.append((key, baseline[key]['ms'], result['ms']))
+    return regressions
+
+
+if __name__ == "__main__":
+    p = ArgumentParser()
+    p.add_argument('--configs', default=sorted(glob.glob('confs/*.yml')), type=str, nargs='+',
+                   help='Training configs whose model_params are benchmarked')
+    p.add_argument('--resolutions', default=['256', '512'], type=str, nargs='+', help='512 or WIDTHxHEIGHT')
+    p.add_argument('--batch_sizes', default=[1, 4], type=int, nargs='+')
+    p.add_argument('--threads', default=[0], type=int, nargs='+', help='torch threads, 0 = library default')
+    p.add_argument('--precisions', default=['fp32', 'bf16'], type=str, nargs='+', choices=list(PRECISIONS))
+    p.add_argument('--modes', default=['forward', 'frozen', 'train'], type=str, nargs='+',
+                   choices=['forward', 'frozen', 'train'])
+    p.add_argument('--device', default='cuda:0' if torch.cuda.is_available() else 'cpu', type=str)
+    p.add_argument('--warmup', default=2, type=int)
+    p.add_argument('--repeats', default=5, type=int)
+    p.add_argument('--output', default=None, type=str, help='Write the results as json')
+    p.add_argument('--baseline', default=None, type=str, help='Results json of an earlier run to compare against')
+    p.add_argument('--tolerance', default=0.1, type=float, help='Allowed relative slowdown against the baseline')
+    argds = p.parse_args()
+
+    default_threads = torch.get_num_threads()
+    results = {}
+    print(f"{'case':<64}{'ms':>10}{'frames/s':>10}")
+    for config_path, resolution, batch_size, threads, precision, mode in itertools.product(
+            argds.configs, argds.resolutions, argds.batch_sizes, argds.threads, argds.precisions, argds.modes):
+        if not precision_supported(precision, argds.device): continue
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f)
+        torch.set_num_threads(threads if threads > 0 else default_threads)
+        h, w = parse_resolution(resolution)
+        model = build(config, mode, argds.device)
+        x = torch.randn(batch_size, config['model_params']['input_channels'], h, w, device=argds.device)
+        ms = time_case(model, x, mode, precision, argds.warmup, argds.repeats)
+        key = f"{os.path.basename(config_path)}|{w}x{h}|b{batch_size}|t{threads}|{precision}|{mode}"
+        results[key] = {'ms': ms, 'fps': batch_size * 1000 / ms}
+        print(f"{key:<64}{ms:>10.2f}{results[key]['fps']:>10.2f}")
+    torch.set_num_threads(default_threads)
+
+    if argds.output is not None:
+        meta = {'device': argds.device, 'torch': torch.__version__, 'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'device_name': torch.cuda.get_device_name(argds.device) if 'cuda' in argds.device else platform.processor()}
+        with open(argds.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=1)
+
+    if argds.baseline is not None:
+        with open(argds.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, argds.tolerance)
+        print(f"{len([k for k in results if k in baseline])} cases compared against {argds.baseline}, "
+              f"{len(regressions)} slower by more than {100 * argds.tolerance:.0f}%")
+        for key, before, after in regressions:
+            print(f"  {key}: {before:.2f} -> {after:.2f} ms ({100 * (after / before - 1):+.1f}%)")
+        sys.exit(1 if len(regressions) > 0 else 0)
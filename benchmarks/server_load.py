@@ -0,0 +1,61 @@
+# Load generator for serve.py: concurrent clients posting raw frames, reports client-side latency and throughput
+# next to the server's own counters. Start the server first, then from the repository root:
+#   python -m benchmarks.server_load --clients 4 --seconds 20 --frame data/Lili/input/00000.png
+from argparse import ArgumentParser
+import http.client
+import json
+import threading
+import time
+
+import numpy as np
+
+from futscml import *
+
+
+def client(host, port, frame, seconds, latencies, errors):
+    connection = http.client.HTTPConnection(host, port)
+    body = frame.tobytes()
+    headers = {'Content-Type': 'application/octet-stream',
+               'X-Height': str(frame.shape[0]), 'X-Width': str(frame.shape[1])}
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        begin = time.perf_counter()
+        connection.request('POST', '/stylize', body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if response.status == 200:
+            latencies.append(time.perf_counter() - begin)
+        else:
+            errors.append(response.status)
+    connection.close()
+
+
+if __name__ == "__main__":
+    p = ArgumentParser()
+    p.add_argument('--host', default='127.0.0.1', type=str)
+    p.add_argument('--port', default=8765, type=int)
+    p.add_argument('--frame', default='data/Lili/input/00000.png', type=str)
+    p.add_argument('--resize', default='flex;8;max;512', type=str, help='Applied to --frame before sending')
+    p.add_argument('--clients', default=4, type=int)
+    p.add_argument('--seconds', default=10., type=float)
+    argds = p.parse_args()
+
+    frame = pil_to_np(FlexResize(ResizeArgs.parse_from_string(argds.resize))(pil_loader(argds.frame)))
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client, args=(argds.host, argds.port, frame, argds.seconds, latencies, errors))
+               for _ in range(argds.clients)]
+    begin = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - begin
+
+    ms = np.array(latencies) * 1000
+    print(f"{argds.clients} clients, {frame.shape[1]}x{frame.shape[0]} frames, {len(errors)} errors")
+    print(f"{'requests':>10}{'p50 ms':>10}{'p99 ms':>10}{'frames/s':>10}")
+    print(f"{len(ms):>10}{np.percentile(ms, 50):>10.2f}{np.percentile(ms, 99):>10.2f}{len(ms) / wall:>10.2f}")
+
+    connection = http.client.HTTPConnection(argds.host, argds.port)
+    connection.request('GET', '/stats')
+    print('server:', json.dumps(json.loads(connection.getresponse().read()), indent=1))
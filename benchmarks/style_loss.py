@@ -0,0 +1,118 @@
+# Gram style loss over the VGG layers of a training config: the former per-layer loop (GramMatrix, repeat,
+# MSELoss into a device buffer) against the fused PackedGramMSELoss, forward + backward from the features.
+# Also times the VGG forward of the loss: all 37 feature modules against stopping at the deepest captured layer,
+# and frame and keyframes as separate passes against one batch.
+# Run from the repository root:
+#   python -m benchmarks.style_loss --resolution 512 --keyframes 2
+# The VGG weights do not matter for timing, features come from a randomly initialized VGG19 unless --pretrained.
+from argparse import ArgumentParser
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torchvision.models as models
+import yaml
+from einops import repeat
+
+from futscml import *
+from futscml.futscml import GramMatrix
+
+
+def extract(vgg, x, layers):
+    feat = []
+    for i, mod in enumerate(vgg, start=1):
+        x = mod(x)
+        if i in layers:
+            feat.append(x)
+        if i >= max(layers): break
+    return feat
+
+
+def loop_loss(feat_frame_y, gmm_pure_y, gmm=GramMatrix(), dist=nn.MSELoss()):
+    loss = torch.empty((len(feat_frame_y),)).to(feat_frame_y[0].device)
+    for l in range(len(feat_frame_y)):
+        gmm_frame_y = gmm(feat_frame_y[l])
+        gmm_frame_y = repeat(gmm_frame_y, '1 h w -> c h w', c=gmm_pure_y[l].shape[0])
+        loss[l] = dist(gmm_pure_y[l].detach(), gmm_frame_y)
+    return torch.sum(loss)
+
+
+def time_ms(step, feats, warmup, repeats):
+    times = []
+    for i in range(warmup + repeats):
+        for f in feats: f.grad = None
+        begin = time.perf_counter()
+        step().backward()
+        if feats[0].is_cuda: torch.cuda.synchronize()
+        if i >= warmup: times.append(time.perf_counter() - begin)
+    return float(np.median(times) * 1000)
+
+
+def forward_ms(step, device, warmup, repeats):
+    times = []
+    with torch.no_grad():
+        for i in range(warmup + repeats):
+            begin = time.perf_counter()
+            step()
+            if 'cuda' in str(device): torch.cuda.synchronize()
+            if i >= warmup: times.append(time.perf_counter() - begin)
+    return float(np.median(times) * 1000)
+
+
+if __name__ == "__main__":
+    p = ArgumentParser()
+    p.add_argument('--config', default='confs/lili.yml', type=str, help='Training config with vgg_layers')
+    p.add_argument('--resolution', default=512, type=int)
+    p.add_argument('--keyframes', default=2, type=int, help='Keyframe batch the frame Grams are compared against')
+    p.add_argument('--pretrained', action='store_true')
+    p.add_argument('--device', default='cuda:0' if torch.cuda.is_available() else 'cpu', type=str)
+    p.add_argument('--warmup', default=3, type=int)
+    p.add_argument('--repeats', default=20, type=int)
+    argds = p.parse_args()
+
+    with open(argds.config, 'r') as f:
+        layers = yaml.safe_load(f)['vgg_layers']
+    weights = models.VGG19_Weights.IMAGENET1K_V1 if argds.pretrained else None
+    vgg = models.vgg19(weights=weights).features.to(argds.device).eval()
+    size = argds.resolution
+    frame_y = torch.randn(1, 3, size, size, device=argds.device)
+    pure_y = torch.randn(argds.keyframes, 3, size, size, device=argds.device)
+    with torch.no_grad():
+        feat_frame_y = extract(vgg, frame_y, layers)
+        feat_pure_y = extract(vgg, pure_y, layers)
+    feat_frame_y = [f.requires_grad_() for f in feat_frame_y]
+
+    fused = PackedGramMSELoss()
+    gmm_pure_y = [GramMatrix()(f) for f in feat_pure_y]
+    packed_pure_y = fused.pack(feat_pure_y)
+
+    reference = loop_loss(feat_frame_y, gmm_pure_y)
+    reference_grad = torch.autograd.grad(reference, feat_frame_y)
+    value = fused(feat_frame_y, packed_pure_y)
+    value_grad = torch.autograd.grad(value, feat_frame_y)
+    grad_err = max(((a - b).abs().max() / b.abs().max().clamp_min(1e-30)).item()
+                   for a, b in zip(value_grad, reference_grad))
+
+    loop = time_ms(lambda: loop_loss(feat_frame_y, gmm_pure_y), feat_frame_y, argds.warmup, argds.repeats)
+    packed = time_ms(lambda: fused(feat_frame_y, packed_pure_y), feat_frame_y, argds.warmup, argds.repeats)
+    print(f"{len(layers)} layers at {size}x{size} against {argds.keyframes} keyframes on {argds.device}")
+    print(f"loss {reference.item():.6e} (loop) {value.item():.6e} (fused), "
+          f"relative difference {abs(value.item() - reference.item()) / abs(reference.item()):.2e}, "
+          f"max relative gradient difference {grad_err:.2e}")
+    print(f"{'':<8}{'ms':>10}")
+    print(f"{'loop':<8}{loop:>10.2f}")
+    print(f"{'fused':<8}{packed:>10.2f}{loop / packed:>9.2f}x")
+
+    both_y = torch.cat([frame_y, pure_y])
+    vgg_full = forward_ms(lambda: vgg(frame_y), argds.device, argds.warmup, argds.repeats)
+    vgg_truncated = forward_ms(lambda: extract(vgg, frame_y, layers), argds.device, argds.warmup, argds.repeats)
+    vgg_separate = forward_ms(lambda: (extract(vgg, frame_y, layers), extract(vgg, pure_y, layers)),
+                              argds.device, argds.warmup, argds.repeats)
+    vgg_batched = forward_ms(lambda: extract(vgg, both_y, layers), argds.device, argds.warmup, argds.repeats)
+    print(f"VGG forward, {len(vgg)} modules, deepest captured layer {max(layers)}")
+    print(f"{'':<10}{'ms':>10}")
+    print(f"{'full':<10}{vgg_full:>10.2f}")
+    print(f"{'truncated':<10}{vgg_truncated:>10.2f}{vgg_full / vgg_truncated:>9.2f}x")
+    print(f"{'separate':<10}{vgg_separate:>10.2f}  (frame and keyframes, truncated)")
+    print(f"{'batched':<10}{vgg_batched:>10.2f}{vgg_separate / vgg_batched:>9.2f}x")
@@ -0,0 +1,45 @@
+# Per-call latency of the warm Stylizer API on one frame, after model load and buffer allocation.
+# Run from the repository root:
+#   python -m benchmarks.stylizer data/Lili/checkpoints checkpoint_best.pth --frame data/Lili/input/00000.png
+from argparse import ArgumentParser
+import time
+
+import numpy as np
+
+from evaluate import make_resize
+from futscml import *
+from stylizer import Stylizer
+
+
+def latencies(stylizer, frame, calls, warmup=5):
+    out = np.empty_like(frame)
+    for _ in range(warmup):
+        stylizer(frame, out=out)
+    times = []
+    for _ in range(calls):
+        begin = time.perf_counter()
+        stylizer(frame, out=out)
+        times.append(time.perf_counter() - begin)
+    return np.array(times) * 1000
+
+
+if __name__ == "__main__":
+    p = ArgumentParser()
+    p.add_argument('checkpoint_dir', type=str)
+    p.add_argument('checkpoint_filename', type=str)
+    p.add_argument('--frame', default='data/Lili/input/00000.png', type=str,
+                   help='Frame to stylize, resized as in evaluate.py')
+    p.add_argument('--device', default=None, type=str)
+    p.add_argument('--calls', default=100, type=int)
+    argds = p.parse_args()
+
+    begin = time.perf_counter()
+    stylizer = Stylizer(argds.checkpoint_dir, argds.checkpoint_filename, device=argds.device)
+    load = time.perf_counter() - begin
+    frame = pil_to_np(FlexResize(ResizeArgs.parse_from_string(make_resize(stylizer.config)))(pil_loader(argds.frame)))
+    print(f"Loaded in {load:.2f}s, {frame.shape[1]}x{frame.shape[0]} on {stylizer.device}")
+
+    ms = latencies(stylizer, frame, argds.calls)
+    print(f"{'calls':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'frames/s':>10}")
+    print(f"{len(ms):>8}{ms.mean():>10.2f}{np.percentile(ms, 50):>10.2f}{np.percentile(ms, 99):>10.2f}"
+          f"{1000 / ms.mean():>10.2f}")
@@ -1,92 +1,470 @@
 from argparse import ArgumentParser
-from datetime import datetime
+import contextlib
+from fractions import Fraction
+import subprocess
+import sys
+import time
 
 import yaml
 from tqdm import tqdm
 import torch
-from torch.utils.data import DataLoader
+import torch.nn.functional as F
 from torch.utils.data import Dataset
-import torchvision
-from einops import rearrange
 
 from futscml import *
-from train import ImageToImageGenerator_JohnsonFutschik
+from generator import ImageToImageGenerator_JohnsonFutschik
 
 class InferDataset(Dataset):
-    def __init__(self, dataroot, xform):
+    '''
+    Yields uint8 frames of dataroot (all, a frame_range slice or the listed frames) from a FrameStore
+    of the whole directory, normalize them on the device with prepare_input.
+    '''
+    def __init__(self, dataroot, resize, frame_range=None, frames=None, cache_dir=None):
         self.root = dataroot
-        self.frames = images_in_directory(self.root)
-        self.xform = xform
-        self.loaded = []
-        for idx in range(len(self.frames)):
-            x = pil_loader(os.path.join(self.root, self.frames[idx]))
-            x = self.xform(x)
-            self.loaded.append(x)
+        self.store = FrameStore(dataroot, resize, cache_dir=cache_dir)
+        self.frames = self.store.frames if frames is None else frames
+        if frame_range is not None:
+            self.frames = self.frames[frame_range[0]:frame_range[1]]
+        lookup = {frame: i for i, frame in enumerate(self.store.frames)}
+        self.indices = [lookup[frame] for frame in self.frames]
 
     def __len__(self):
         return len(self.frames)
 
     def __getitem__(self, idx):
-        x = self.loaded[idx]
-        return x, self.frames[idx]
+        return self.store[self.indices[idx]], self.frames[idx]
+
+
+def load_config(checkpoint_dir):
+    with open(os.path.join(checkpoint_dir, 'config.yml'), 'r') as f:
+        return yaml.safe_load(f)
+
+
+def load_generator(config, checkpoint_path, device=None, freeze=True, subpixel=True):
+    model = ImageToImageGenerator_JohnsonFutschik(config=config, **config['model_params'])
+    ckpt = torch.load(checkpoint_path, map_location='cpu')['state_dict']
+    model.load_state_dict(ckpt)
+    model = model.to(device if device is not None else config['device']).eval()
+    if freeze:
+        model = freeze_for_inference(model, subpixel=subpixel)
+    return model
+
+
+def make_resize(config):
+    return f'flex;8;max;{config["resize"]}' if config["resize"] is not None else f'flex;8'
+
+
+def make_transform(config):
+    return ImageTensorConverter(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5], resize=make_resize(config), drop_alpha=True)
+
+
+def prepare_input(t, config, device=None):
+    t = t.to(device if device is not None else config['device'])
+    if t.dtype == torch.uint8:
+        t = normalize_frames(t)
+    if config['model_params']['input_channels'] == 4:
+        ones = torch.ones_like(t[:, :1], device=t.device)
+        t = torch.cat([ones, t], dim=1)
+    return t
+
+
+def shard_range(num_frames, shard, num_shards):
+    # contiguous, balanced split of [0, num_frames)
+    return num_frames * shard // num_shards, num_frames * (shard + 1) // num_shards
+
+
+def segment_path(output_dir, shard, num_shards):
+    return os.path.join(output_dir, 'segments', f'segment_{shard:04d}_of_{num_shards:04d}.mp4')
+
+
+def merge_segments(output_dir, num_shards, num_frames):
+    # a shard with an empty frame range renders nothing and writes no segment
+    paths = [segment_path(output_dir, i, num_shards) for i in range(num_shards)
+             if len(range(*shard_range(num_frames, i, num_shards))) > 0]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Missing segments: {missing}")
+    video_path = os.path.join(output_dir, 'output.mp4')
+    concat_videos(paths, video_path)
+    print(f"Merged {len(paths)} segments into {video_path}")
+
+
+def launch_workers(argv, num_workers, threads=None, memory_budget=None):
+    '''
+    Re-runs this script as num_workers shards with disjoint core sets and waits for them.
+    memory_budget (GB) is split evenly between the shards.
+    '''
+    cores = sorted(os.sched_getaffinity(0))
+    threads = threads if threads is not None else max(1, len(cores) // num_workers)
+    # drop --workers from the command line, the children get --shard instead
+    child_argv = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+            continue
+        if arg == '--workers':
+            skip = True
+            continue
+        if arg.startswith('--workers='):
+            continue
+        child_argv.append(arg)
+    workers = []
+    for i in range(num_workers):
+        worker_cores = cores[(i * threads) % len(cores):][:threads]
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+        cmd = [sys.executable, os.path.abspath(__file__)] + child_argv + [
+            '--shard', f'{i}/{num_workers}', '--threads', str(threads),
+            '--cpus', ','.join(str(c) for c in worker_cores)]
+        if memory_budget is not None:
+            cmd += ['--memory_budget', str(memory_budget / num_workers)]
+        workers.append(subprocess.Popen(cmd, env=env))
+    failed = [i for i, worker in enumerate(workers) if worker.wait() != 0]
+    if failed:
+        raise RuntimeError(f"Shards {failed} failed")
+
 
 if __name__ == "__main__":
     p = ArgumentParser()
     p.add_argument('checkpoint_dir', help='Checkpoint directory', type=str)
-    p.add_argument('checkpoint_filename', help='Network checkpoint', type=str)
+    p.add_argument('checkpoint_filename', type=str,
+                   help='Network checkpoint, or a comma separated list (e.g. 05m_snapshot.pth,01h_snapshot.pth) to render '
+                        'each into its own video plus a side-by-side comparison')
     p.add_argument('output_dir', help='Output dir', type=str)
-    p.add_argument('input_dir', help='Input directory to stylize', type=str)
+    p.add_argument('input_dir', help='Input directory to stylize, or a video file (mp4, mov, ...)', type=str)
+    p.add_argument('--batch_size', default='1', type=str,
+                   help='Frames per forward pass, or "auto" to probe the largest batch fitting --memory_budget')
+    p.add_argument('--no_freeze', action='store_true',
+                   help='Run the training module instead of the BatchNorm-folded inference generator')
+    p.add_argument('--no_subpixel', action='store_true',
+                   help='Keep nearest upsample + conv in the frozen generator instead of sub-pixel convolutions')
+    p.add_argument('--memory_budget', default=4., type=float, help='Memory budget in GB for --batch_size auto')
+    p.add_argument('--resize', default=None, type=str,
+                   help='Override the long edge from config.yml, "none" keeps the native resolution')
+    p.add_argument('--tile', default=0, type=int, help='Tile size for tiled inference, 0 = whole frames')
+    p.add_argument('--tile_halo', default=None, type=int,
+                   help='Context discarded at interior tile edges, defaults to the measured receptive field radius')
+    p.add_argument('--tile_feather', default=32, type=int, help='Width of the cross-fade between neighbouring tiles')
+    p.add_argument('--device', default=None, type=str, help='Override the device from config.yml, e.g. cpu')
+    p.add_argument('--shard', default=None, type=str,
+                   help='i/N: render only the i-th of N contiguous frame ranges into its own segment (e.g. SLURM arrays)')
+    p.add_argument('--merge', default=None, type=int,
+                   help='Concatenate the segments of N shards into output.mp4 without re-encoding and exit')
+    p.add_argument('--workers', default=1, type=int, help='Render locally with this many sharded processes')
+    p.add_argument('--threads', default=None, type=int, help='Torch / ONNX Runtime threads per process')
+    p.add_argument('--cpus', default=None, type=str, help='Comma separated cores to pin this process to')
+    p.add_argument('--incremental', action='store_true',
+                   help='Keep per-frame outputs and a manifest in <output>/frames, skip frames rendered by a previous '
+                        'run with the same checkpoint, config and input, then rebuild the video from the frames')
+    p.add_argument('--output_cache', action='store_true',
+                   help='Reuse outputs of checksum-identical input frames, persisted per checkpoint and config')
+    p.add_argument('--output_cache_dir', default=None, type=str,
+                   help='Where --output_cache keeps its entries, defaults to <checkpoint_dir>/output_cache')
+    p.add_argument('--output_cache_gb', default=20., type=float,
+                   help='Disk budget of --output_cache, least recently used entries are evicted beyond it')
+    p.add_argument('--frame_cache_dir', default=None, type=str,
+                   help='Where decoded input frames are cached, defaults to .<input>.framestore next to the input '
+                        'directory, or the user cache directory when that is not writable')
+    p.add_argument('--decode_workers', default=2, type=int, help='Threads decoding and resizing input frames')
+    p.add_argument('--queue_size', default=8, type=int,
+                   help='Batches buffered between the decode, inference and encode stages')
+    p.add_argument('--preview', action='store_true',
+                   help='Quick look: every --preview_stride-th frame at --preview_resize, upsampled back and written '
+                        'as a low bitrate preview.mp4. Decoded frames are cached for the full render')
+    p.add_argument('--preview_stride', default=4, type=int)
+    p.add_argument('--preview_resize', default=256, type=int, help='Long edge the generator runs at in --preview')
+    p.add_argument('--precision', default='fp32', choices=['fp32', 'bf16', 'fp16'], type=str,
+                   help='Autocast precision, bf16 works on CPU and recent GPUs, fp16 on CUDA only')
+    p.add_argument('--channels_last', action='store_true', help='Run the generator in channels_last memory format')
+    p.add_argument('--min_psnr', default=40., type=float,
+                   help='Refuse --precision / --channels_last when sample outputs fall below this PSNR against fp32')
+    p.add_argument('--precision_check_frames', default=4, type=int, help='Frames compared against fp32')
+    p.add_argument('--backend', default='torch', choices=['torch', 'onnxruntime'], type=str)
+    p.add_argument('--onnx_path', default=None, type=str,
+                   help='Model exported by export.py, defaults to <checkpoint>.onnx in the checkpoint directory')
+    p.add_argument('--int8', action='store_true',
+                   help='With the onnxruntime backend, default to the quantized <checkpoint>.int8.onnx from quantize.py')
+    p.add_argument('--intra_op_threads', default=0, type=int, help='ONNX Runtime intra-op threads, 0 = runtime default')
     p.set_defaults(feature=False)
     argds = p.parse_args()
 
     if argds.checkpoint_dir.endswith(os.sep):
         argds.checkpoint_dir = argds.checkpoint_dir[:-1]
 
-    _, experiment_name = os.path.split(argds.checkpoint_dir)
-    conf_filepath = os.path.join(argds.checkpoint_dir, 'config.yml')
-    with open(conf_filepath, 'r') as f:
-        config = yaml.safe_load(f)
+    checkpoints = argds.checkpoint_filename.split(',')
+    if len(checkpoints) > 1 and (argds.backend != 'torch' or argds.shard is not None or argds.workers > 1
+                                 or argds.incremental or argds.output_cache):
+        p.error('Several checkpoints render with the torch backend only, without --shard, --workers, '
+                '--incremental and --output_cache')
+    video_input = is_video_file(argds.input_dir)
+    if argds.preview and (video_input or len(checkpoints) > 1 or argds.shard is not None or argds.workers > 1
+                          or argds.incremental or argds.output_cache):
+        p.error('--preview renders a frame directory with a single checkpoint, without --shard, --workers, '
+                '--incremental and --output_cache')
+    if video_input and (argds.shard is not None or argds.workers > 1 or argds.incremental):
+        p.error('--shard, --workers and --incremental need a directory of frames as input')
+
+    if argds.merge is not None:
+        merge_segments(argds.output_dir, argds.merge, len(images_in_directory(argds.input_dir)))
+        sys.exit(0)
+    if argds.workers > 1:
+        num_frames = len(images_in_directory(argds.input_dir))
+        # no shard without frames to render
+        num_workers = max(1, min(argds.workers, num_frames))
+        launch_workers(sys.argv[1:], num_workers, argds.threads, argds.memory_budget)
+        merge_segments(argds.output_dir, num_workers, num_frames)
+        sys.exit(0)
+
+    if argds.cpus is not None:
+        os.sched_setaffinity(0, [int(c) for c in argds.cpus.split(',')])
+    if argds.threads is not None:
+        torch.set_num_threads(argds.threads)
+        if argds.intra_op_threads == 0:
+            argds.intra_op_threads = argds.threads
+
+    config = load_config(argds.checkpoint_dir)
 
     config['input'] = argds.input_dir
     config['output'] = argds.output_dir
-    config['checkpoint'] = os.path.join(argds.checkpoint_dir, argds.checkpoint_filename)
+    config['checkpoint'] = os.path.join(argds.checkpoint_dir, checkpoints[0])
+    if argds.device is not None:
+        config['device'] = argds.device
+    if argds.resize is not None:
+        config['resize'] = None if argds.resize.lower() == 'none' else int(argds.resize)
 
-    model = ImageToImageGenerator_JohnsonFutschik(config=config, **config['model_params'])
+    if argds.backend == 'onnxruntime':
+        if argds.batch_size == 'auto':
+            p.error('--batch_size auto needs the torch backend')
+        onnx_path = argds.onnx_path
+        if onnx_path is None:
+            onnx_path = os.path.splitext(config['checkpoint'])[0] + ('.int8.onnx' if argds.int8 else '.onnx')
+        model = OnnxRuntimeModel(onnx_path, intra_op_threads=argds.intra_op_threads)
+        config['device'] = 'cpu'
+    else:
+        # all resident at once, every decoded frame goes through each of them in turn
+        models = [load_generator(config, os.path.join(argds.checkpoint_dir, checkpoint),
+                                 freeze=not argds.no_freeze, subpixel=not argds.no_subpixel)
+                  for checkpoint in checkpoints]
+        model = models[0]
 
-    ckpt = torch.load(config['checkpoint'])['state_dict']
-    model.load_state_dict(ckpt)
+    if argds.tile > 0:
+        try:
+            assert_tileable(model)
+        except ValueError as e:
+            p.error(f"--tile: {e}")
+        if argds.tile_halo is None:
+            if not isinstance(model, torch.nn.Module):
+                p.error('--tile with the onnxruntime backend needs an explicit --tile_halo')
+            radius = receptive_field_radius(model, config['model_params']['input_channels'])
+            argds.tile_halo = -(-radius // 8) * 8
+        print(f"Tiled inference: {argds.tile}px tiles, halo {argds.tile_halo}px, feather {argds.tile_feather}px")
+
+    frames = images_in_directory(config['input']) if not video_input else []
+    video_path, manifest_name = os.path.join(config['output'], 'output.mp4'), 'manifest'
+    if argds.preview:
+        num_all_frames = len(frames)
+        frames = frames[::argds.preview_stride]
+        video_path = os.path.join(config['output'], 'preview.mp4')
+    if argds.shard is not None:
+        shard, num_shards = (int(v) for v in argds.shard.split('/'))
+        frame_range = shard_range(len(frames), shard, num_shards)
+        frames = frames[frame_range[0]:frame_range[1]]
+        video_path = segment_path(config['output'], shard, num_shards)
+        manifest_name = f'manifest_{shard:04d}_of_{num_shards:04d}'
+        print(f"Shard {shard}/{num_shards}: frames [{frame_range[0]}, {frame_range[1]})")
+
+    # everything besides the input that changes the pixels of the output, the tile halo is resolved by now
+    render_key = None
+    if argds.incremental or argds.output_cache:
+        render_key = {
+            'checkpoint': file_digest(config['checkpoint']) if argds.backend == 'torch' else file_digest(onnx_path),
+            'config': config_digest({'model_params': config['model_params'], 'resize': config['resize'],
+                                     'freeze': not argds.no_freeze, 'subpixel': not argds.no_subpixel,
+                                     'tile': [argds.tile, argds.tile_halo, argds.tile_feather],
+                                     'precision': [argds.precision, argds.channels_last]}),
+        }
+    pending, manifest = frames, None
+    if argds.incremental:
+        manifest = RenderManifest(os.path.join(config['output'], 'frames'), name=manifest_name)
+        frame_keys = {frame: dict(render_key, input=file_digest(os.path.join(config['input'], frame)))
+                      for frame in frames}
+        pending = [frame for frame in frames if not manifest.is_done(frame, frame_keys[frame])]
+        print(f"{len(frames) - len(pending)} of {len(frames)} frames already rendered")
+    if video_input:
+        # decoded while rendering, frames never touch the disk
+        reader = VideoFrameReader(config['input'], resize=make_resize(config))
+        fps, time_base, num_frames = reader.fps, reader.time_base, reader.num_frames or None
+        print(f"Streaming {config['input']}: {num_frames or 'unknown number of'} frames at {float(fps):.3f} fps")
+        items, decode, decode_workers = reader, lambda item: item[2], 1
+        first = reader.head(1)
+        sample = first[0][2] if len(first) > 0 else None
+    else:
+        dataset = InferDataset(config['input'], make_resize(config), frames=pending,
+                               cache_dir=argds.frame_cache_dir)
+        fps, time_base, num_frames = 24, None, len(dataset)
+        # items are (name, pts, payload) for both inputs
+        items = [(frame, None, i) for i, frame in enumerate(dataset.frames)]
+        decode, decode_workers = lambda item: dataset[item[2]][0], argds.decode_workers
+        sample = dataset[0][0] if len(dataset) > 0 else None
+
+    def run_model(t, net=None, tile_batch_size=None):
+        net = net if net is not None else model
+        if argds.tile > 0:
+            return tiled_forward(net, t, argds.tile, argds.tile_halo, feather=argds.tile_feather,
+                                 batch_size=tile_batch_size if tile_batch_size is not None else batch_size)
+        return net(t)
+
+    if argds.precision != 'fp32' or argds.channels_last:
+        if argds.backend != 'torch':
+            p.error('--precision and --channels_last need the torch backend')
+        if not precision_supported(argds.precision, config['device']):
+            p.error(f"{argds.precision} is not supported on {config['device']}")
+        if video_input:
+            check = [x for _, _, x in reader.head(argds.precision_check_frames)]
+        else:
+            # spread over the shot
+            picks = np.linspace(0, len(dataset) - 1, argds.precision_check_frames).astype(int) if len(dataset) > 0 else []
+            check = [dataset[i][0] for i in sorted(set(int(i) for i in picks))]
+        check = [prepare_input(x.unsqueeze(0), config) for x in check]
+        # every checkpoint gets wrapped below, so every one is checked, tiled the same way as the render
+        for checkpoint, net in zip(checkpoints, models):
+            if len(check) == 0: break
+            results = compare_precisions(net, check, channels_last=argds.channels_last,
+                                         forward=lambda net, x: run_model(x, net, tile_batch_size=1))
+            print(f"{'precision':<10}{'frames/s':>10}{'min PSNR':>10}  ({checkpoint}, {len(check)} frames, "
+                  f"channels_last={argds.channels_last})")
+            for precision, result in results.items():
+                print(f"{precision:<10}{result['fps']:>10.2f}{result['min_psnr']:>10.1f}")
+            if results[argds.precision]['min_psnr'] < argds.min_psnr:
+                p.error(f"{checkpoint}: {argds.precision} falls to {results[argds.precision]['min_psnr']:.1f} dB "
+                        f"PSNR against fp32, below --min_psnr {argds.min_psnr}")
+        models = [PrecisionWrapper(net, argds.precision, channels_last=argds.channels_last) for net in models]
+        model = models[0]
+
+    output_cache = None
+    if argds.output_cache:
+        cache_dir = argds.output_cache_dir or os.path.join(argds.checkpoint_dir, 'output_cache')
+        output_cache = OutputCache(os.path.join(cache_dir, config_digest(render_key)),
+                                   max_bytes=int(argds.output_cache_gb * 1024 ** 3))
+
+    def render(t):
+        '''
+        t = batch from the dataset, returns uint8 NHWC frames
+        '''
+        if output_cache is None:
+            return tensor_to_uint8_frames(run_model(prepare_input(t, config)))
+        keys = [tensor_digest(x) for x in t]
+        found = {}
+        for key in keys:
+            if key in found:
+                # repeated within the batch, rendered at most once
+                output_cache.hits += 1
+            else:
+                found[key] = output_cache.get(key)
+        missing = [key for key, v in found.items() if v is None]
+        if len(missing) > 0:
+            r = run_model(prepare_input(t[[keys.index(key) for key in missing]], config))
+            for key, out in zip(missing, tensor_to_uint8_frames(r).cpu().numpy()):
+                found[key] = output_cache.put(key, out)
+        return torch.from_numpy(np.stack([found[key] for key in keys]))
+
+    def preview_size(h, w):
+        scale = argds.preview_resize / max(h, w)
+        return max(8, int(h * scale) // 8 * 8), max(8, int(w * scale) // 8 * 8)
+
+    def infer(t, items):
+        if argds.preview:
+            # the generator is fully convolutional, run it small and scale the result back for display
+            x = prepare_input(t, config)
+            small = F.interpolate(x, size=preview_size(*x.shape[-2:]), mode='bilinear', antialias=True)
+            y = F.interpolate(run_model(small), size=x.shape[-2:], mode='bilinear')
+            return tensor_to_uint8_frames(y).cpu()
+        if len(checkpoints) == 1:
+            return render(t).cpu()
+        t = prepare_input(t, config)
+        return [tensor_to_uint8_frames(run_model(t, net)).cpu() for net in models]
+
+    if argds.batch_size == 'auto' and sample is not None:
+        # sample stays the raw frame, the preview estimate below prepares it again
+        probe = prepare_input(sample.unsqueeze(0), config)
+        if argds.tile > 0:
+            probe = probe[..., :argds.tile, :argds.tile]
+        batch_size = discover_batch_size(model, probe, argds.memory_budget * 1024 ** 3,
+                                         cache_path=os.path.join(argds.checkpoint_dir, 'batch_size_cache.json'),
+                                         checkpoint_digest=file_digest(config['checkpoint']))
+        print(f"Using batch size {batch_size} for {tuple(probe.shape[-2:])} on {config['device']}")
+    else:
+        batch_size = int(argds.batch_size) if argds.batch_size != 'auto' else 1
+    if batch_size > 1 and isinstance(model, torch.nn.Module):
+        # Batched outputs only match the batch-1 path when BatchNorm uses running statistics
+        assert_batch_independent(model)
+
+    os.makedirs(os.path.dirname(video_path), exist_ok=True)
+
+    # writers are finalized even when rendering fails part way
+    with contextlib.ExitStack() as stack:
+        # in incremental mode the frames go to disk first and the video is rebuilt from them at the end
+        writer = None
+        if argds.preview:
+            # proxy quality, at a frame rate that keeps the duration of the shot
+            writer = stack.enter_context(StreamingVideoWriter(video_path, Fraction(fps) / argds.preview_stride,
+                                                              options={'crf': '35', 'preset': 'veryfast'}))
+        elif manifest is None and len(checkpoints) == 1:
+            writer = stack.enter_context(StreamingVideoWriter(video_path, fps, options={'crf': '18'},
+                                                              time_base=time_base))
+        pbar = tqdm(total=num_frames)
+        if len(checkpoints) > 1:
+            # one video per checkpoint, left to right in the given order in the side-by-side one
+            writers = [stack.enter_context(StreamingVideoWriter(
+                           os.path.join(config['output'], os.path.splitext(checkpoint)[0] + '.mp4'), fps,
+                           options={'crf': '18'}, time_base=time_base))
+                       for checkpoint in checkpoints + ['side_by_side']]
+
+        def encode(r, items):
+            frames = [frame for frame, _, _ in items]
+            pbar.set_description("Processing: " + frames[0])
+            # source timestamps when the input is a video
+            pts = [pts for _, pts, _ in items] if time_base is not None else None
+            if len(checkpoints) > 1:
+                for w, output in zip(writers, r + [torch.cat(r, dim=2)]):
+                    w.write(output, pts=pts)
+            elif manifest is None:
+                writer.write(r, pts=pts)
+            else:
+                for frame, image in zip(frames, r.numpy()):
+                    output = os.path.splitext(frame)[0] + '.png'
+                    np_to_pil(image).save(manifest.output_path(output))
+                    manifest.record(frame, frame_keys[frame], output)
+            pbar.update(len(frames))
+
+        # with tiling the batch is made of tiles of a single frame
+        pipeline = InferencePipeline(decode=decode, infer=infer, encode=encode,
+                                     batch_size=batch_size if argds.tile == 0 else 1,
+                                     decode_workers=decode_workers, queue_size=argds.queue_size)
+        with torch.no_grad():
+            pipeline.run(items)
+        pbar.close()
+        print(pipeline.report())
 
-    model = model.to(config['device']).eval()
-
-    transform = ImageTensorConverter(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5],
-                                     resize=f'flex;8;max;{config["resize"]}' if config["resize"] is not None else f'flex;8', drop_alpha=True)
-    dataset = InferDataset(config['input'], transform)
-    dataset = DataLoader(dataset, num_workers=0, batch_size=1)
-
-    if not os.path.exists(config['output']):
-        os.makedirs(config['output'])
-
-    generated = []
-    begin = datetime.now()
-    with torch.no_grad():
-        with torch.amp.autocast(dtype=torch.float16, device_type='cuda', enabled=False):
-            pbar = tqdm(dataset)
-            for batch in pbar:
-                t, p = batch[0], batch[1]
-                pbar.set_description("Processing: " + p[0])
-                t = t.to(config['device'])
-                if config['model_params']['input_channels'] == 4:
-                    ones = torch.ones_like(t[:, :1], device=t.device)
-                    t = torch.cat([ones, t], dim=1)
-                r = model(t)
-                r = torch.clip(r, -1, 1)
-                n, c, h, w = r.shape
-                for i in range(n):
-                    # transform(r[i]).save(os.path.join(config['output'], p[i]))
-                    generated.append(r[i:i+1] * 127.5 + 127.5)
-
-    video = torch.cat(generated, dim=0).cpu()
-    video_path = os.path.join(config['output'], 'output.mp4')
-    fps = 24
-    torchvision.io.write_video(video_path, rearrange(video, 'b c h w -> b h w c'), fps, options={'crf': '18'})
+        if argds.preview and sample is not None:
+            # time a full resolution frame to estimate what the full render would cost
+            x = prepare_input(sample.unsqueeze(0), config)
+            with torch.no_grad():
+                for _ in range(2):
+                    begin = time.perf_counter()
+                    run_model(x)
+                    if x.is_cuda: torch.cuda.synchronize()
+                    full_frame = time.perf_counter() - begin
+            estimate = full_frame * num_all_frames
+            print(f"Preview: {len(frames)} of {num_all_frames} frames at {preview_size(*x.shape[-2:])[::-1]} in "
+                  f"{pipeline.wall:.1f}s. Full render at {tuple(x.shape[-2:])[::-1]}: ~{estimate:.1f}s of inference, "
+                  f"~{estimate - pipeline.wall:.1f}s saved")
 
+        if manifest is not None:
+            manifest.close()
+            writer = stack.enter_context(StreamingVideoWriter(video_path, fps, options={'crf': '18'}))
+            for frame in tqdm(frames, desc='Rebuilding video'):
+                image = pil_loader(manifest.output_path(manifest.entries[frame]['output']))
+                writer.write(pil_to_np(image)[None])
+    if output_cache is not None:
+        print(output_cache.summary())
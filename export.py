@@ -0,0 +1,59 @@
+from argparse import ArgumentParser
+
+import torch
+
+from evaluate import load_config, load_generator, make_transform, prepare_input
+from futscml import *
+
+
+def export_onnx(model, sample, path, opset_version=17):
+    dynamic = {0: 'batch', 2: 'height', 3: 'width'}
+    torch.onnx.export(model, sample, path, input_names=['input'], output_names=['output'],
+                      dynamic_axes={'input': dynamic, 'output': dynamic}, opset_version=opset_version,
+                      do_constant_folding=True)
+
+
+def export_torch(model, sample, path):
+    from torch.export import export, dynamic_dim, save
+    constraints = [dynamic_dim(sample, 0), dynamic_dim(sample, 2), dynamic_dim(sample, 3)]
+    exported = export(model, (sample,), constraints=constraints)
+    save(exported, path)
+
+
+if __name__ == "__main__":
+    p = ArgumentParser()
+    p.add_argument('checkpoint_dir', help='Checkpoint directory', type=str)
+    p.add_argument('checkpoint_filename', help='Network checkpoint', type=str)
+    p.add_argument('--output', default=None, type=str,
+                   help='Output file, defaults to the checkpoint path with .onnx / .pt2 extension')
+    p.add_argument('--format', default='onnx', choices=['onnx', 'torch_export'], type=str)
+    p.add_argument('--opset', default=17, type=int)
+    p.add_argument('--input_dir', default=None, type=str,
+                   help='Take the sample input shape from the first frame of this directory instead of a resize x resize square')
+    p.add_argument('--no_subpixel', action='store_true')
+    argds = p.parse_args()
+
+    config = load_config(argds.checkpoint_dir)
+    checkpoint = os.path.join(argds.checkpoint_dir, argds.checkpoint_filename)
+    # exported artifacts are meant for CPU runtimes
+    config['device'] = 'cpu'
+    model = load_generator(config, checkpoint, subpixel=not argds.no_subpixel)
+
+    if argds.input_dir is not None:
+        transform = make_transform(config)
+        sample = transform(pil_loader(os.path.join(argds.input_dir, images_in_directory(argds.input_dir)[0]))).unsqueeze(0)
+    else:
+        side = config['resize'] if config['resize'] is not None else 512
+        sample = torch.zeros(1, 3, side, side)
+    sample = prepare_input(sample, config)
+
+    output = argds.output
+    if output is None:
+        output = os.path.splitext(checkpoint)[0] + ('.onnx' if argds.format == 'onnx' else '.pt2')
+
+    with torch.no_grad():
+        if argds.format == 'onnx':
+            export_onnx(model, sample, output, opset_version=argds.opset)
+        else:
+            export_torch(model, sample, output)
+    print(f"Exported {argds.format} model to {output}")
@@ -1,17 +1,26 @@
 from .futscml import *
 #from .nnfutils import grid_vote, load_torchified_nnf, nnf_upsample_linear, nnf_to_dat, torchify_nnf
-from .osutil import dir_diff
-from .datamanip import parse_img, pack_img, cut_patch, cut_patches
+from .osutil import dir_diff, file_digest
+from .datamanip import parse_img, pack_img, cut_patch, cut_patches, gather_patches
 from .models import *
 from .model_forward import image_to_image_net_forward, capture_layer_indices
+from .model_forward import assert_batch_independent, assert_tileable, probe_batch_size, discover_batch_size
+from .model_forward import OnnxRuntimeModel, receptive_field_radius, tiled_forward
+from .model_forward import InferencePipeline
+from .model_forward import PRECISIONS, PrecisionWrapper, compare_precisions, precision_supported
 from .logger import FileLogger, LossLogger
 from .logger import TensorboardLogger
 from .datasets import RestrictedCIFAR10, ImageDirectory, DirectoryOfSubdirectories, InfiniteDatasetSampler
+from .datasets import FrameStore, normalize_frames
 from .colormap import colormap_value
+from .video import StreamingVideoWriter, tensor_to_uint8_frames, concat_videos
+from .video import VideoFrameReader, SeekableVideo, is_video_file
+from .render_cache import RenderManifest, OutputCache, config_digest, tensor_digest
 #from .style_transfer import make_extractor, gatys_style_transfer
 #from .strotss import strotss
 #from .adversarial_attacks import fgsm_attack_targeted
-from .model_tricks import conv_swap_channels_inplace
+from .model_tricks import conv_swap_channels_inplace, fold_batch_norms, convert_to_subpixel
+from .model_tricks import freeze_for_inference, FrozenGenerator
 #try:
     # not essential
 #    from .pyebsynth import ebsynth, suggest_pyramid_levels
@@ -55,23 +55,49 @@ def cut_patch(chw_tensor, midpoint, size):
         p = r
     return p
 
+def gather_patches(images, ys, xs, size):
+    '''
+    Cuts size x size patches with top-left corners (ys[i], xs[i]) out of every image of a list of NCHW tensors.
+    Returns a list with one (N * num_patches, C, size, size) tensor per image, batch-major like
+    rearrange('b c n k1 k2 -> (b n) c k1 k2'). Images of equal batch and spatial size are gathered together
+    with a single advanced-indexing op.
+    '''
+    single = torch.is_tensor(images)
+    images = [images] if single else list(images)
+    device = images[0].device
+    ys = torch.as_tensor(ys, device=device).long()
+    xs = torch.as_tensor(xs, device=device).long()
+    offsets = torch.arange(size, device=device)
+    # (num_patches, size, 1) and (num_patches, 1, size) broadcast to every pixel of every patch
+    rows = (ys[:, None] + offsets)[:, :, None]
+    cols = (xs[:, None] + offsets)[:, None, :]
+
+    def gather(x):
+        # (N, C, num_patches, size, size) -> (N * num_patches, C, size, size)
+        p = x[:, :, rows, cols].transpose(1, 2)
+        return p.reshape(-1, x.shape[1], size, size)
+
+    groups = {}
+    for i, x in enumerate(images):
+        key = (x.shape[0], x.shape[2], x.shape[3], x.dtype, x.device)
+        groups.setdefault(key, []).append(i)
+    outputs = [None] * len(images)
+    for indices in groups.values():
+        if len(indices) == 1:
+            outputs[indices[0]] = gather(images[indices[0]])
+            continue
+        channels = [images[i].shape[1] for i in indices]
+        patches = gather(torch.cat([images[i] for i in indices], dim=1))
+        for i, p in zip(indices, patches.split(channels, dim=1)):
+            outputs[i] = p
+    return outputs[0] if single else outputs
+
 def cut_patches(nchw_tensor, midpoints, size):
     # assume midpoints are valid indices that dont go outside of the (image + size)
-    assert nchw_tensor.shape[0] == 1, "Cut patches is not implemented for batches"
-
-    # Can be done using 2x unfold(..), but that will cut out all the patches, whereas I expect
-    # that the number of patches will be relatively small
-    
-    
     half = size // 2
-    # the naive way
-    ys, xs = midpoints[0], midpoints[1]
-    num_patches = len(ys)
-    output = torch.empty(num_patches, nchw_tensor.shape[1], size, size).to(nchw_tensor.device)
-    
-    for h, w, i in zip(ys, xs, range(num_patches)):
-        output[i, :, :, :] = nchw_tensor[:, :, int(h-half):int(h+half), int(w-half):int(w+half)]
-    return output
+    ys = torch.as_tensor(midpoints[0]).long() - half
+    xs = torch.as_tensor(midpoints[1]).long() - half
+    return gather_patches(nchw_tensor, ys, xs, size)
 
 if __name__ == "__main__":
     t = torch.rand((1, 3, 64, 64))
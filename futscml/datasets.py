@@ -6,6 +6,9 @@ import numpy as np
 import sys
 import torch
 from futscml import is_image, pil_loader, images_in_directory, subdirectories
+from futscml import FlexResize, ResizeArgs
+import hashlib
+import json
 
 if sys.version_info[0] == 2:
     import cPickle as pickle
@@ -270,6 +273,117 @@ class RestrictedCIFAR10(data.Dataset):
         return "Split: {}".format("Train" if self.train is True else "Test")
 
 
+def normalize_frames(x, mean=0.5, std=0.5):
+    '''
+    uint8 frames from a FrameStore to float, same arithmetic as ToTensor + Normalize.
+    Call it after moving the batch to the compute device, so only uint8 crosses the bus.
+    '''
+    return x.float().div_(255).sub_(mean).div_(std)
+
+
+class FrameStore(data.Dataset):
+    '''
+    Frames of a directory decoded and resized at most once into a uint8 cache file, read through a memory map.
+    The cache lives in .<dirname>.framestore next to the directory, or in cache_dir, or under
+    $XDG_CACHE_HOME/futscml/framestore when the parent of the directory is not writable (read-only input mounts).
+    It is keyed by the frame names, their sizes and modification times and the resize, so it is rebuilt when
+    any of them changes. The layout comes from the image headers alone, frames are decoded on first access and
+    marked as filled, so a run that touches only some frames (e.g. a preview) leaves them cached for the next one.
+    Items are uint8 CHW tensors, see normalize_frames. The maps are opened on first access in each process,
+    so DataLoader workers and other processes read the cache file through the shared page cache. Each item is
+    copied out of the map, so consumers may modify it without touching the cache.
+    '''
+    def __init__(self, root, resize=None, frames=None, cache_dir=None):
+        self.root = root
+        self.frames = images_in_directory(root) if frames is None else list(frames)
+        self.resize = FlexResize(ResizeArgs.parse_from_string(resize)) if isinstance(resize, str) else resize
+        key = hashlib.sha1(repr(resize).encode('utf-8'))
+        for frame in self.frames:
+            st = os.stat(os.path.join(root, frame))
+            key.update(f'{frame}:{st.st_size}:{st.st_mtime_ns};'.encode('utf-8'))
+        if cache_dir is None:
+            cache_dir = self.default_cache_dir(root)
+        self.path = os.path.join(cache_dir, key.hexdigest() + '.u8')
+        if not os.path.exists(self.path + '.json'):
+            self._build()
+        with open(self.path + '.json', 'r') as f:
+            index = json.load(f)
+        self.offsets = index['offsets']
+        self.shapes = [tuple(shape) for shape in index['shapes']]
+        self._data = None
+        self._filled = None
+
+    @staticmethod
+    def default_cache_dir(root):
+        parent, name = os.path.split(os.path.abspath(root))
+        if os.access(parent, os.W_OK):
+            return os.path.join(parent, f'.{name}.framestore')
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        path_key = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(base, 'futscml', 'framestore', f'{name}-{path_key}')
+
+    def _shape(self, frame):
+        # opening only parses the header
+        with Image.open(os.path.join(self.root, frame)) as im:
+            h, w = self.resize.output_size(im) if self.resize is not None else (im.height, im.width)
+        return 3, h, w
+
+    def _build(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shapes = [self._shape(frame) for frame in self.frames]
+        offsets = np.cumsum([0] + [c * h * w for c, h, w in shapes]).tolist()
+        # unique temporaries, several processes may build the same store at once
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        for path, size in ((self.path, offsets[-1]), (self.path + '.filled', len(self.frames))):
+            with open(tmp, 'wb') as f:
+                # sparse, zero filled
+                f.truncate(size)
+            os.replace(tmp, path)
+        # the index is written last, its presence marks a usable store
+        with open(tmp, 'w') as f:
+            json.dump({'frames': self.frames, 'offsets': offsets[:-1], 'shapes': shapes}, f)
+        os.replace(tmp, self.path + '.json')
+
+    def _load(self, frame):
+        x = pil_loader(os.path.join(self.root, frame))
+        if self.resize is not None:
+            x = self.resize(x)
+        return np.asarray(x, dtype=np.uint8).transpose(2, 0, 1)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        state['_filled'] = None
+        return state
+
+    def __len__(self):
+        return len(self.frames)
+
+    def index(self, frame):
+        return self.frames.index(frame)
+
+    def __getitem__(self, idx):
+        if self._data is None:
+            # a store prepared elsewhere and shared read-only can still serve the frames it has filled
+            mode = 'r+' if os.access(self.path, os.W_OK) and os.access(self.path + '.filled', os.W_OK) else 'r'
+            self._filled = np.memmap(self.path + '.filled', dtype=np.uint8, mode=mode)
+            self._data = np.memmap(self.path, dtype=np.uint8, mode=mode)
+        c, h, w = self.shapes[idx]
+        view = self._data[self.offsets[idx]:self.offsets[idx] + c * h * w].reshape(c, h, w)
+        if not self._filled[idx]:
+            if self._data.mode == 'r':
+                raise PermissionError(f"{self.path}: frame {self.frames[idx]} is not cached and the store is "
+                                      f"read-only, pass a writable cache_dir")
+            x = self._load(self.frames[idx])
+            if x.shape != (c, h, w):
+                raise ValueError(f"{self.frames[idx]}: decoded to {x.shape}, expected {(c, h, w)} from the header")
+            view[...] = x
+            # set after the pixels, a reader never sees a filled flag on an unwritten frame
+            self._filled[idx] = 1
+            return torch.from_numpy(np.ascontiguousarray(x))
+        return torch.from_numpy(np.array(view))
+
+
 
 if __name__ == "__main__":
     labels = [2,5]
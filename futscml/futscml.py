@@ -84,10 +84,13 @@ class FlexResize():
         ar_resized_long = (max / x.height) if short_w else (max / x.width)
         return int(x.height * ar_resized_long), int(x.width * ar_resized_long)
 
-    def __call__(self, x):
+    def output_size(self, x):
+        # only needs x.width and x.height, so a lazily opened image works without decoding
         h, w = self.keep_ar_sizes(x, self.max)
-        h = h - (h % self.align_to)
-        w = w - (w % self.align_to)
+        return h - (h % self.align_to), w - (w % self.align_to)
+
+    def __call__(self, x):
+        h, w = self.output_size(x)
         return functional.resize(x, [h, w], antialias=True)
 
 
@@ -270,6 +273,12 @@ def tensor_resample(tensor, dst_size, mode='bilinear'):
                          align_corners=None if mode == 'nearest' else False)
 
 
+def psnr(x, y, data_range=2.):
+    # default data_range fits [-1, 1] tensors
+    mse = F.mse_loss(x.float(), y.float())
+    return (10 * torch.log10(data_range ** 2 / mse.clamp_min(1e-12))).item()
+
+
 def pil_resize_short_edge_to(pil, trg_size):
     short_w = pil.width < pil.height
     ar_resized_short = (trg_size / pil.width) if short_w else (trg_size / pil.height)
@@ -495,6 +504,49 @@ class GramMatrixMSELoss(nn.Module):
         return out
 
 
+class PackedGramMSELoss(nn.Module):
+    '''
+    Sum over layers of MSELoss(GramMatrix()(x_l), target_l), fused. Feature maps of the same shape share one bmm,
+    Gram matrices are kept as packed upper triangles (off-diagonal terms weighted twice) grouped by channel count,
+    and the result is accumulated on the device into one scalar. A target batch of 1 broadcasts against the other.
+        targets = loss.pack(pure_features)  # {channels: (layers, n, c * (c + 1) // 2)}
+        value = loss(frame_features, targets)
+    '''
+    def __init__(self):
+        super().__init__()
+        self.indices = {}
+
+    def _indices(self, c, device):
+        key = (c, str(device))
+        if key not in self.indices:
+            rows, cols = torch.triu_indices(c, c, device=device)
+            weights = torch.where(rows == cols, 1., 2.).to(device) / (c * c)
+            self.indices[key] = (rows * c + cols, weights)
+        return self.indices[key]
+
+    def pack(self, features):
+        shapes = {}
+        for f in features:
+            shapes.setdefault(tuple(f.shape), []).append(f)
+        packed = {}
+        for (n, c, h, w), group in shapes.items():
+            M = torch.cat(group, dim=0).view(len(group) * n, c, h * w)
+            G = torch.bmm(M, M.transpose(1, 2)).div_(c * h * w)
+            flat, _ = self._indices(c, G.device)
+            packed.setdefault(c, []).append(G.view(len(group), n, c * c)[:, :, flat])
+        return {c: torch.cat(parts, dim=0) for c, parts in packed.items()}
+
+    def forward(self, features, targets):
+        grams = self.pack(features)
+        parts = []
+        for c, G in grams.items():
+            T = targets[c].detach()
+            _, weights = self._indices(c, G.device)
+            # per layer mean over the broadcast batch and all c x c entries
+            parts.append(((G - T).square() * weights).sum() / max(G.shape[1], T.shape[1]))
+        return torch.stack(parts).sum()
+
+
 class ChannelwiseGaussianBlur(nn.Module):
     def __init__(self):
         super().__init__()
@@ -569,7 +621,7 @@ def accuracy(output, target, topk=(1,)):
 
 def absorb_bn(conv, bn):
     conv_w_c = conv.weight.data.clone()
-    conv_b_c = conv.bias.data.clone()
+    conv_b_c = conv.bias.data.clone() if conv.bias is not None else torch.zeros_like(bn.running_mean)
     invstd = bn.running_var.clone().add_(bn.eps).pow_(-0.5)
     conv_w_c.data.mul_(invstd.view(conv_w_c.shape[0], 1, 1, 1).expand_as(conv_w_c))
     conv_b_c.data.add_(-bn.running_mean).mul_(invstd)
@@ -579,7 +631,7 @@ def absorb_bn(conv, bn):
     new_conv = nn.Conv2d(in_channels=conv.in_channels, out_channels=conv.out_channels,
                          kernel_size=conv.kernel_size,
                          padding=conv.padding, padding_mode=conv.padding_mode,
-                         dilation=conv.dilation, stride=conv.stride)
+                         dilation=conv.dilation, stride=conv.stride, groups=conv.groups)
     new_conv.weight.data = conv_w_c
     new_conv.bias.data = conv_b_c
     return new_conv
@@ -1,4 +1,12 @@
-from .futscml import guess_model_device
+from .futscml import guess_model_device, psnr
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import json
+import os
+import queue
+import threading
+import time
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -52,6 +60,455 @@ def image_to_image_net_forward(model, dataset, batch_size=1, device='cuda:0', ch
                 yield result[sample]
 
 
+def assert_batch_independent(model):
+    '''
+    Batched inference only reproduces the batch-1 outputs when no layer mixes samples,
+    i.e. every BatchNorm runs in eval mode on its running statistics.
+    '''
+    for name, module in model.named_modules():
+        if isinstance(module, nn.modules.batchnorm._BatchNorm):
+            if module.training or module.running_mean is None:
+                raise ValueError(f"{name}: BatchNorm must be in eval mode with running statistics for batched inference")
+
+
+def assert_tileable(model):
+    '''
+    Tiles only reproduce the whole-frame output when every normalization uses fixed statistics. InstanceNorm,
+    GroupNorm, LayerNorm and BatchNorm in training mode normalize each tile by its own statistics.
+    '''
+    if not isinstance(model, nn.Module):
+        return
+    for name, module in model.named_modules():
+        if isinstance(module, (nn.modules.instancenorm._InstanceNorm, nn.GroupNorm, nn.LayerNorm)):
+            raise ValueError(f"{name}: {type(module).__name__} normalizes per tile, tiled inference needs batch_norm")
+        if isinstance(module, nn.modules.batchnorm._BatchNorm) and (module.training or module.running_mean is None):
+            raise ValueError(f"{name}: BatchNorm must be in eval mode with running statistics for tiled inference")
+
+
+def _leaf_activation_bytes(model, x):
+    # Sum of all leaf module outputs, an upper bound of what a no_grad forward keeps alive
+    total = [0]
+    def hook(module, inputs, output):
+        if torch.is_tensor(output):
+            total[0] += output.numel() * output.element_size()
+    handles = [m.register_forward_hook(hook) for m in model.modules() if len(list(m.children())) == 0]
+    try:
+        model(x)
+    finally:
+        for h in handles:
+            h.remove()
+    return total[0]
+
+
+def _cuda_peak_bytes(model, x):
+    device = x.device
+    torch.cuda.synchronize(device)
+    torch.cuda.reset_peak_memory_stats(device)
+    base = torch.cuda.memory_allocated(device)
+    model(x)
+    torch.cuda.synchronize(device)
+    return torch.cuda.max_memory_allocated(device) - base
+
+
+def probe_batch_size(model, sample, memory_budget, max_batch_size=64):
+    '''
+    Largest batch size whose forward pass fits into memory_budget bytes at the resolution of sample (1, C, H, W).
+    On CUDA the peak allocation is measured (doubling, then bisection); elsewhere it is extrapolated
+    from the activation footprint of a single sample.
+    '''
+    assert_batch_independent(model)
+    with torch.no_grad():
+        if sample.device.type != 'cuda':
+            per_sample = _leaf_activation_bytes(model, sample)
+            return int(max(1, min(max_batch_size, memory_budget // max(per_sample, 1))))
+
+        def fits(batch_size):
+            x = sample.expand(batch_size, -1, -1, -1).contiguous()
+            try:
+                return _cuda_peak_bytes(model, x) <= memory_budget
+            except torch.cuda.OutOfMemoryError:
+                return False
+            finally:
+                del x
+                torch.cuda.empty_cache()
+
+        good, bad = 0, None
+        batch_size = 1
+        while batch_size <= max_batch_size:
+            if not fits(batch_size):
+                bad = batch_size
+                break
+            good = batch_size
+            batch_size *= 2
+        if bad is None:
+            bad = max_batch_size + 1
+        while bad - good > 1:
+            mid = (good + bad) // 2
+            if fits(mid):
+                good = mid
+            else:
+                bad = mid
+        return max(good, 1)
+
+
+def _load_batch_size_cache(cache_path):
+    # a file cut short or garbled counts as empty, the entries are only probed again
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def discover_batch_size(model, sample, memory_budget, cache_path=None, checkpoint_digest=None, max_batch_size=64):
+    '''
+    probe_batch_size with the result cached per (checkpoint, resolution, device, budget) in a json file.
+    Safe for several processes (e.g. --workers shards) sharing the file.
+    '''
+    device = sample.device
+    device_name = torch.cuda.get_device_name(device) if device.type == 'cuda' else device.type
+    key = f'{checkpoint_digest}:{sample.shape[-2]}x{sample.shape[-1]}:{device}:{device_name}:{int(memory_budget)}'
+    cache = _load_batch_size_cache(cache_path) if cache_path is not None else {}
+    if key in cache:
+        return cache[key]
+    batch_size = probe_batch_size(model, sample, memory_budget, max_batch_size=max_batch_size)
+    if cache_path is not None:
+        # merge with the entries other processes wrote while probing, then replace the file in one step
+        cache = _load_batch_size_cache(cache_path)
+        cache[key] = batch_size
+        tmp = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp, cache_path)
+    return batch_size
+
+
+def receptive_field_radius(model, channels, probe_size=128, max_probe_size=1024, device=None):
+    '''
+    Radius in input pixels of the region that influences a single output pixel, measured as the extent
+    of the input gradient of the central output pixel. The probe grows until the extent fits inside it.
+    Only meaningful for models accepted by assert_tileable.
+    '''
+    assert_tileable(model)
+    if device is None:
+        device = guess_model_device(model)
+    while True:
+        x = torch.randn(1, channels, probe_size, probe_size, device=device, requires_grad=True)
+        with torch.enable_grad():
+            y = model(x)
+            y[..., probe_size // 2, probe_size // 2].sum().backward()
+        touched = x.grad.abs().sum(dim=(0, 1)) > 0
+        rows = touched.any(dim=1).nonzero()
+        cols = touched.any(dim=0).nonzero()
+        c = probe_size // 2
+        radius = max(c - rows.min().item(), rows.max().item() - c, c - cols.min().item(), cols.max().item() - c)
+        if radius < c - 1 or probe_size >= max_probe_size:
+            return radius
+        probe_size *= 2
+
+
+def _tile_starts(size, tile, stride):
+    if size <= tile:
+        return [0]
+    starts = list(range(0, size - tile, stride))
+    starts.append(size - tile)
+    return starts
+
+
+def _edge_ramp(length, halo, feather, ramp_start, ramp_end, device):
+    # 0 for the halo next to an interior tile edge, linear ramp over feather pixels, then 1
+    ramp = torch.ones(length, device=device)
+    slope = torch.arange(1, feather + 1, device=device, dtype=torch.float32) / (feather + 1)
+    if ramp_start:
+        ramp[:halo] = 0
+        ramp[halo:halo + feather] = slope[:max(0, min(feather, length - halo))]
+    if ramp_end:
+        ramp[length - halo:] = 0
+        ramp[length - halo - feather:length - halo] = torch.minimum(
+            ramp[length - halo - feather:length - halo], slope.flip(0))
+    return ramp
+
+
+def tiled_forward(model, x, tile_size, halo, feather=32, batch_size=1, align=8):
+    '''
+    Runs a fully convolutional model over overlapping tiles of x (N, C, H, W) and blends the outputs,
+    so activation memory is bounded by the tile size rather than the frame size.
+    Neighbouring tiles overlap by 2 * halo + feather pixels. Each tile discards the halo next to its
+    interior edges and cross-fades with its neighbour over the feather band. With halo at least the
+    receptive field radius and tile origins on the model's downsampling grid (multiples of align),
+    the result equals the untiled forward pass. Models with per-input normalization are refused, see assert_tileable.
+    '''
+    assert_tileable(model)
+    n, _, h, w = x.shape
+    if h <= tile_size and w <= tile_size:
+        return model(x)
+    if h % align or w % align or tile_size % align:
+        raise ValueError(f"Frame {h}x{w} and tile size {tile_size} must be multiples of {align}")
+    stride = (tile_size - 2 * halo - feather) // align * align
+    if stride <= 0:
+        raise ValueError(f"Tile size {tile_size} too small for halo {halo} and feather {feather}")
+    th, tw = min(tile_size, h), min(tile_size, w)
+    boxes = [(y0, x0) for y0 in _tile_starts(h, th, stride) for x0 in _tile_starts(w, tw, stride)]
+
+    output, weight = None, torch.zeros(1, 1, h, w, device=x.device)
+    for y0, x0 in boxes:
+        wy = _edge_ramp(th, halo, feather, y0 > 0, y0 + th < h, x.device)
+        wx = _edge_ramp(tw, halo, feather, x0 > 0, x0 + tw < w, x.device)
+        weight[..., y0:y0 + th, x0:x0 + tw] += wy[:, None] * wx[None, :]
+
+    for i in range(n):
+        for b in range(0, len(boxes), batch_size):
+            chunk = boxes[b:b + batch_size]
+            tiles = torch.cat([x[i:i + 1, :, y0:y0 + th, x0:x0 + tw] for y0, x0 in chunk], dim=0)
+            result = model(tiles)
+            if output is None:
+                output = torch.zeros(n, result.shape[1], h, w, device=x.device, dtype=result.dtype)
+            for (y0, x0), tile in zip(chunk, result):
+                wy = _edge_ramp(th, halo, feather, y0 > 0, y0 + th < h, x.device)
+                wx = _edge_ramp(tw, halo, feather, x0 > 0, x0 + tw < w, x.device)
+                output[i, :, y0:y0 + th, x0:x0 + tw] += tile * (wy[:, None] * wx[None, :])
+    return output / weight.clamp_min(1e-8)
+
+
+class OnnxRuntimeModel:
+    '''
+    Wraps an ONNX Runtime session so it can stand in for the torch generator: NCHW float tensors in and out.
+    '''
+    def __init__(self, path, intra_op_threads=0, inter_op_threads=0, providers=('CPUExecutionProvider',)):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=options, providers=list(providers))
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+        self.device = torch.device('cpu')
+
+    def __call__(self, x):
+        x = x.detach().to(self.device, torch.float32).contiguous().numpy()
+        y = self.session.run([self.output_name], {self.input_name: x})[0]
+        return torch.from_numpy(y)
+
+
+
+_END = object()
+
+
+class InferencePipeline:
+    '''
+    Overlaps frame decoding, inference and encoding: decode runs in a thread pool, infer in the calling thread
+    (so grad mode and the CUDA context stay as set up by the caller) and encode in a writer thread.
+    The stages are connected by bounded queues, so a slow stage blocks the ones feeding it instead of
+    letting frames pile up in memory. Items keep their order through all stages.
+        decode(item) -> CHW tensor
+        infer(NCHW tensor, items) -> outputs, preferably already on the host so device time counts as inference
+        encode(outputs, items)
+    '''
+    def __init__(self, decode, infer, encode, batch_size=1, decode_workers=2, queue_size=8):
+        self.decode = decode
+        self.infer = infer
+        self.encode = encode
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+
+    def _timed(self, stage, fn, *args):
+        begin = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.busy[stage] += time.perf_counter() - begin
+
+    def _fail(self, error):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    def _put(self, q, value):
+        # poll so that a failed stage cannot leave its producer blocked on a full queue
+        while not self._stop.is_set():
+            try:
+                q.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return _END
+
+    def _pull(self, items):
+        # pulling from a streaming source such as a video decoder counts as decoding too
+        iterator = iter(items)
+        while True:
+            begin = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                with self._lock:
+                    self.busy['decode'] += time.perf_counter() - begin
+            yield item
+
+    def _decoder(self, items):
+        try:
+            with ThreadPoolExecutor(self.decode_workers) as pool:
+                pending = collections.deque()
+                for item in self._pull(items):
+                    pending.append((item, pool.submit(self._timed, 'decode', self.decode, item)))
+                    if len(pending) > self.decode_workers:
+                        item, future = pending.popleft()
+                        if not self._put(self._decoded, (item, future.result())): return
+                while len(pending) > 0:
+                    item, future = pending.popleft()
+                    if not self._put(self._decoded, (item, future.result())): return
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._put(self._decoded, _END)
+
+    def _encoder(self):
+        try:
+            while True:
+                entry = self._get(self._encoded)
+                if entry is _END: break
+                self._timed('encode', self.encode, *entry)
+        except BaseException as e:
+            self._fail(e)
+
+    def run(self, items):
+        self.busy = {'decode': 0., 'infer': 0., 'encode': 0.}
+        self.frames = 0
+        self._error = None
+        self._stop = threading.Event()
+        self._decoded = queue.Queue(self.queue_size)
+        self._encoded = queue.Queue(self.queue_size)
+        threads = [threading.Thread(target=self._decoder, args=(items,), daemon=True),
+                   threading.Thread(target=self._encoder, daemon=True)]
+        begin = time.perf_counter()
+        for t in threads:
+            t.start()
+        try:
+            done = False
+            while not done:
+                batch = []
+                while len(batch) < self.batch_size:
+                    entry = self._get(self._decoded)
+                    if entry is _END:
+                        done = True
+                        break
+                    batch.append(entry)
+                if len(batch) == 0: break
+                batch_items = [item for item, _ in batch]
+                outputs = self._timed('infer', self.infer, torch.stack([x for _, x in batch]), batch_items)
+                if not self._put(self._encoded, (outputs, batch_items)): break
+                self.frames += len(batch)
+            self._put(self._encoded, _END)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            for t in threads:
+                t.join()
+            self.wall = time.perf_counter() - begin
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def utilization(self):
+        '''
+        Fraction of the wall time each stage spent working, decode is averaged over its workers.
+        The stage closest to 1 is the bottleneck, the others spend the rest waiting on it.
+        '''
+        workers = {'decode': self.decode_workers, 'infer': 1, 'encode': 1}
+        return {stage: self.busy[stage] / (workers[stage] * max(self.wall, 1e-9)) for stage in self.busy}
+
+    def report(self):
+        utilization = self.utilization()
+        bottleneck = max(utilization, key=utilization.get)
+        lines = [f"{self.frames} frames in {self.wall:.2f}s ({self.frames / max(self.wall, 1e-9):.2f} frames/s)"]
+        for stage, u in utilization.items():
+            lines.append(f"  {stage:<8}{100 * u:6.1f}% busy{'  <- bottleneck' if stage == bottleneck else ''}")
+        return '\n'.join(lines)
+
+
+
+PRECISIONS = {'fp32': torch.float32, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+def precision_supported(precision, device):
+    device = torch.device(device)
+    if precision == 'fp16':
+        # CPU autocast has no useful fp16 kernels for these convolutions
+        return device.type == 'cuda'
+    if precision == 'bf16' and device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    return precision in PRECISIONS
+
+
+class PrecisionWrapper(nn.Module):
+    '''
+    Runs model under autocast at the given precision, optionally with channels_last activations and weights.
+    Inputs and outputs stay fp32 NCHW, so it drops in wherever the plain model is called.
+    '''
+    def __init__(self, model, precision='fp32', channels_last=False):
+        super().__init__()
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}, expected one of {list(PRECISIONS)}")
+        self.model = model
+        self.precision = precision
+        self.channels_last = channels_last
+        if channels_last:
+            self.model.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        with torch.autocast(device_type=x.device.type, dtype=PRECISIONS[self.precision],
+                            enabled=self.precision != 'fp32'):
+            y = self.model(x)
+        return y.float().contiguous()
+
+
+def compare_precisions(model, frames, precisions=('fp32', 'bf16', 'fp16'), channels_last=False, repeats=3,
+                       forward=None):
+    '''
+    frames = list of NCHW inputs. Runs model at every precision supported on the device of the frames and reports
+    frames/s and the worst PSNR against the fp32 outputs, as {precision: {'fps': .., 'min_psnr': ..}}.
+    forward(net, x) runs one input, e.g. through tiled_forward, net(x) when None.
+    '''
+    forward = forward if forward is not None else lambda net, x: net(x)
+    device = frames[0].device
+    results = {}
+    with torch.no_grad():
+        reference = [forward(model, x) for x in frames]
+        for precision in precisions:
+            if not precision_supported(precision, device): continue
+            wrapped = PrecisionWrapper(model, precision, channels_last=channels_last)
+            outputs = [forward(wrapped, x) for x in frames]
+            if device.type == 'cuda': torch.cuda.synchronize()
+            begin = time.perf_counter()
+            for _ in range(repeats):
+                for x in frames:
+                    forward(wrapped, x)
+            if device.type == 'cuda': torch.cuda.synchronize()
+            results[precision] = {
+                'fps': repeats * sum(x.shape[0] for x in frames) / (time.perf_counter() - begin),
+                'min_psnr': min(psnr(y, r) for y, r in zip(outputs, reference)),
+            }
+    return results
+
+
 # Example usecase
 if __name__ == "__main__":
     class InferDataset(Dataset):
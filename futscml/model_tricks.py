@@ -1,7 +1,100 @@
+import copy
+
+import torch
+import torch.nn as nn
+
+from .futscml import absorb_bn
+from .models import SmoothUpsampleLayer, SubPixelUpsampleLayer
+
 
 def conv_swap_channels_inplace(conv_layer, new_order):
     conv_layer.weight.data[:, :, :, :] = conv_layer.weight.data[:, new_order, :, :]
     # Bias is unchanged
     # if conv_layer.bias is not None:
     #     conv_layer.bias.data[:, :, :, :] = conv_layer.weight.data[:, new_order, :, :]
-    return conv_layer
\ No newline at end of file
+    return conv_layer
+
+
+def fold_batch_norms(sequential):
+    '''
+    Copy of an nn.Sequential where each Conv2d or SmoothUpsampleLayer directly followed by
+    a BatchNorm2d with running statistics is replaced by a single conv with the norm absorbed.
+    Anything else (InstanceNorm, a norm after a nonlinearity) is copied as is.
+    '''
+    layers = list(sequential)
+    folded = []
+    i = 0
+    while i < len(layers):
+        layer = layers[i]
+        norm = layers[i + 1] if i + 1 < len(layers) else None
+        if isinstance(norm, nn.BatchNorm2d) and norm.running_mean is not None:
+            if isinstance(layer, nn.Conv2d):
+                folded.append(absorb_bn(layer, norm))
+                i += 2
+                continue
+            if isinstance(layer, SmoothUpsampleLayer):
+                upsample = copy.deepcopy(layer)
+                upsample.conv = absorb_bn(layer.conv, norm)
+                folded.append(upsample)
+                i += 2
+                continue
+        folded.append(copy.deepcopy(layer))
+        i += 1
+    return nn.Sequential(*folded)
+
+
+def convert_to_subpixel(sequential):
+    '''
+    Replaces every SmoothUpsampleLayer in an nn.Sequential by its exact SubPixelUpsampleLayer form.
+    '''
+    return nn.Sequential(*[SubPixelUpsampleLayer.from_smooth_upsample(layer)
+                           if isinstance(layer, SmoothUpsampleLayer) else layer for layer in sequential])
+
+
+class FrozenGenerator(nn.Module):
+    '''
+    Inference-only twin of ImageToImageGenerator_JohnsonFutschik with the BatchNorms folded
+    into the convolutions and the conv2 stem evaluated once. With subpixel=True the upconv
+    layers run as sub-pixel convolutions at the low resolution.
+    '''
+    def __init__(self, model, subpixel=True):
+        super().__init__()
+        self.conv0 = fold_batch_norms(model.conv0)
+        self.conv1 = fold_batch_norms(model.conv1)
+        self.conv2 = fold_batch_norms(model.conv2)
+        self.resnets = nn.ModuleList([fold_batch_norms(block) for block in model.resnets])
+        self.upconv2 = fold_batch_norms(model.upconv2)
+        self.upconv1 = fold_batch_norms(model.upconv1)
+        if subpixel:
+            self.upconv2 = convert_to_subpixel(self.upconv2)
+            self.upconv1 = convert_to_subpixel(self.upconv1)
+        self.conv_11 = fold_batch_norms(model.conv_11)
+        self.end_blocks = fold_batch_norms(model.end_blocks) if model.end_blocks is not None else None
+        self.conv_12 = copy.deepcopy(model.conv_12)
+
+    def forward(self, x):
+        output_0 = self.conv0(x)
+        output_1 = self.conv1(output_0)
+        # The training module runs conv2 twice on the same input, once for the resnet trunk
+        # and once for the skip connection; both results are identical in eval mode.
+        output_2 = self.conv2(output_1)
+        output = output_2
+        for layer in self.resnets:
+            output = layer(output) + output
+
+        output = self.upconv2(torch.cat((output, output_2), dim=1))
+        output = self.upconv1(torch.cat((output, output_1), dim=1))
+        output = self.conv_11(torch.cat((output, output_0, x), dim=1))
+        if self.end_blocks is not None:
+            output = self.end_blocks(output)
+        output = self.conv_12(output)
+        return output
+
+
+def freeze_for_inference(model, subpixel=True):
+    model.eval()
+    frozen = FrozenGenerator(model, subpixel=subpixel)
+    for param in frozen.parameters():
+        param.requires_grad = False
+    return frozen.eval()
+
@@ -245,15 +245,94 @@ class AdditiveNoise(nn.Module):
             return x + self.sigma * torch.empty_like(x).normal_()
         return x
 
+def smooth_upsample_phase_kernels(weight):
+    '''
+    Nearest 2x upsampling followed by a 3x3 conv equals four 2x2 convs on the low resolution input,
+    one per output phase (row parity a, column parity b). Returns them stacked as (out * 4, in, 2, 2)
+    in pixel_shuffle channel order, i.e. channel o * 4 + a * 2 + b.
+    '''
+    # Rows (columns) of a 2x2 phase kernel as sums of the 3x3 kernel rows (columns);
+    # even outputs see input rows (i-1, i), odd outputs see (i, i+1).
+    mix = weight.new_tensor([[[1, 0, 0], [0, 1, 1]],
+                             [[1, 1, 0], [0, 0, 1]]])
+    kernels = torch.einsum('ayk,oikl,bxl->oabiyx', mix, weight, mix)
+    return kernels.reshape(weight.shape[0] * 4, weight.shape[1], 2, 2)
+
+
+SUBPIXEL_PADDING_MODES = ('zeros', 'replicate', 'circular')
+
+
+def subpixel_smooth_upsample(x, phase_weight, phase_bias=None, padding_mode='zeros'):
+    '''
+    Applies the phase kernels from smooth_upsample_phase_kernels at the input resolution and
+    interleaves the phases with pixel_shuffle. Exact for zero, replicate and circular padding,
+    where padding the input by one pixel equals padding the upsampled image by one pixel.
+    '''
+    if padding_mode not in SUBPIXEL_PADDING_MODES:
+        raise ValueError(f"Sub-pixel upsampling is not exact for padding mode {padding_mode}")
+    n, _, h, w = x.shape
+    if padding_mode == 'zeros':
+        x = F.pad(x, (1, 1, 1, 1))
+    else:
+        x = F.pad(x, (1, 1, 1, 1), mode=padding_mode)
+    # every phase is evaluated on the padded (h + 1, w + 1) grid, phase (a, b) starts at offset (a, b)
+    y = F.conv2d(x, phase_weight, phase_bias)
+    y = y.view(n, -1, 2, 2, h + 1, w + 1)
+    phases = [y[:, :, a, b, a:a + h, b:b + w] for a in range(2) for b in range(2)]
+    y = torch.stack(phases, dim=2).view(n, -1, h, w)
+    return F.pixel_shuffle(y, 2)
+
+
 class SmoothUpsampleLayer(nn.Module):
-    def __init__(self, in_filters, out_filters, scale_factor=2, scaling_mode='nearest', bias=False):
+    def __init__(self, in_filters, out_filters, scale_factor=2, scaling_mode='nearest', bias=False,
+                 padding_mode='zeros', subpixel=False):
         super().__init__()
         self.upsample = nn.Upsample(scale_factor=scale_factor, mode=scaling_mode)
-        self.conv = nn.Conv2d(in_channels=in_filters, out_channels=out_filters, bias=bias, padding=1, kernel_size=3)
+        self.conv = nn.Conv2d(in_channels=in_filters, out_channels=out_filters, bias=bias, padding=1, kernel_size=3,
+                              padding_mode=padding_mode)
+        # Same parameters either way, so checkpoints are interchangeable
+        self.subpixel = subpixel
+        if subpixel:
+            assert scale_factor == 2 and scaling_mode == 'nearest'
+            assert padding_mode in SUBPIXEL_PADDING_MODES
 
     def forward(self, x):
+        if self.subpixel:
+            bias = self.conv.bias.repeat_interleave(4) if self.conv.bias is not None else None
+            return subpixel_smooth_upsample(x, smooth_upsample_phase_kernels(self.conv.weight), bias,
+                                            self.conv.padding_mode)
         return self.conv(self.upsample(x))
 
+
+class SubPixelUpsampleLayer(nn.Module):
+    '''
+    Inference form of SmoothUpsampleLayer with the phase kernels precomputed.
+    '''
+    def __init__(self, in_filters, out_filters, bias=False, padding_mode='zeros'):
+        super().__init__()
+        assert padding_mode in SUBPIXEL_PADDING_MODES
+        self.weight = nn.Parameter(torch.zeros(out_filters * 4, in_filters, 2, 2))
+        self.bias = nn.Parameter(torch.zeros(out_filters * 4)) if bias else None
+        self.padding_mode = padding_mode
+
+    @classmethod
+    def from_smooth_upsample(cls, layer):
+        assert isinstance(layer.upsample, nn.Upsample)
+        assert layer.upsample.scale_factor in (2, 2., (2, 2), (2., 2.)) and layer.upsample.mode == 'nearest'
+        conv = layer.conv
+        assert conv.kernel_size == (3, 3) and conv.padding == (1, 1) and conv.stride == (1, 1)
+        converted = cls(conv.in_channels, conv.out_channels, bias=conv.bias is not None,
+                        padding_mode=conv.padding_mode)
+        with torch.no_grad():
+            converted.weight.data = smooth_upsample_phase_kernels(conv.weight.detach())
+            if conv.bias is not None:
+                converted.bias.data = conv.bias.detach().repeat_interleave(4)
+        return converted
+
+    def forward(self, x):
+        return subpixel_smooth_upsample(x, self.weight, self.bias, self.padding_mode)
+
+
 class SmoothUpsampleLayer3D(nn.Module):
     def __init__(self, in_filters, out_filters, depth, depth_padding, scale_factor=2, scaling_mode='nearest', bias=False):
         super().__init__()
@@ -1,4 +1,5 @@
 import os
+import hashlib
 
 def dir_diff(dir1, dir2, verb=False):
     if not os.path.exists(dir1):
@@ -24,4 +25,12 @@ def dir_diff(dir1, dir2, verb=False):
         print("In dir2 but not in dir1:")
         for i in l4:
             print("\t" + i)
-    return l3, l4
\ No newline at end of file
+    return l3, l4
+
+
+def file_digest(path, algorithm='sha1', chunk_size=1 << 20):
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
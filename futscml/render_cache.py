@@ -0,0 +1,155 @@
+import collections
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def config_digest(obj):
+    # stable hash of anything json serializable
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class RenderManifest:
+    '''
+    Append-only json-lines record of rendered frames kept next to the per-frame outputs.
+    A frame counts as done when its recorded key (e.g. checkpoint, config and input hashes) equals
+    the current one and its output file still exists. Every *.jsonl in the directory is read, so
+    several shards can each append to their own file.
+    '''
+    def __init__(self, directory, name='manifest'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.entries = {}
+        for path in sorted(glob.glob(os.path.join(directory, '*.jsonl'))):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line of a killed run may be cut short
+                        continue
+                    self.entries[entry['frame']] = entry
+        self.file = open(os.path.join(directory, f'{name}.jsonl'), 'a')
+
+    def is_done(self, frame, key):
+        entry = self.entries.get(frame)
+        return entry is not None and entry['key'] == key and os.path.exists(self.output_path(entry['output']))
+
+    def output_path(self, output):
+        return os.path.join(self.directory, output)
+
+    def record(self, frame, key, output):
+        entry = {'frame': frame, 'key': key, 'output': output}
+        self.entries[frame] = entry
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def tensor_digest(t):
+    # hash of the exact values, so only checksum-identical frames collide
+    t = t.detach().cpu().contiguous()
+    h = hashlib.sha1(f'{t.dtype}:{tuple(t.shape)}:'.encode('utf-8'))
+    h.update(t.numpy().tobytes())
+    return h.hexdigest()
+
+
+class OutputCache:
+    '''
+    Content-addressed store of rendered frames, keyed by the digest of the generator input.
+    Outputs are uint8 HWC arrays saved as .npy files in `directory`, which should be specific to
+    the checkpoint and render config. The last few are also kept in memory for held frames.
+    The directory is kept under max_bytes by evicting the least recently used entries (by mtime,
+    hits touch their file). Each process only accounts for the entries it has seen, so shards
+    sharing a directory can overshoot the budget by what the others wrote since they started.
+    '''
+    def __init__(self, directory, memory_entries=16, max_bytes=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.memory = collections.OrderedDict()
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # on-disk entries, least recently used first
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.npy'):
+                st = entry.stat()
+                entries.append((st.st_mtime_ns, entry.name[:-len('.npy')], st.st_size))
+        self.sizes = collections.OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.bytes = sum(self.sizes.values())
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npy')
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _touch(self, key):
+        if key in self.sizes:
+            self.sizes.move_to_end(key)
+            try:
+                os.utime(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        while self.max_bytes is not None and self.bytes > self.max_bytes and len(self.sizes) > 1:
+            key, size = self.sizes.popitem(last=False)
+            self.bytes -= size
+            self.memory.pop(key, None)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                # already evicted by another shard
+                pass
+            self.evictions += 1
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and os.path.exists(self._path(key)):
+            try:
+                value = np.load(self._path(key))
+            except FileNotFoundError:
+                value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(key, value)
+        self._touch(key)
+        return value
+
+    def put(self, key, value):
+        value = np.ascontiguousarray(value)
+        # write then rename so an interrupted run never leaves a truncated entry behind,
+        # the pid keeps shards that render the same input from writing the same temp file
+        tmp = f'{self._path(key)}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, value)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, self._path(key))
+        self.bytes += size - self.sizes.pop(key, 0)
+        self.sizes[key] = size
+        self._remember(key, value)
+        self._evict()
+        return value
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.
+
+    def summary(self):
+        return (f"Output cache: {self.hits} hits, {self.misses} misses ({100 * self.hit_rate:.1f}% hit rate), "
+                f"{self.bytes / 1024 ** 3:.2f} GB on disk, {self.evictions} evicted")
@@ -0,0 +1,274 @@
+import collections
+import contextlib
+import itertools
+import json
+import os
+
+import av
+import numpy as np
+import torch
+from PIL import Image
+
+from .futscml import FlexResize, ResizeArgs
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.mkv', '.avi', '.webm', '.m4v')
+
+
+def is_video_file(path):
+    return os.path.isfile(path) and os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def tensor_to_uint8_frames(x):
+    '''
+    Converts a [-1, 1] NCHW tensor to a uint8 NHWC tensor without leaving its device.
+    The cast truncates, same as torchvision.io.write_video does for float input.
+    '''
+    x = torch.clip(x, -1, 1) * 127.5 + 127.5
+    return x.to(torch.uint8).permute(0, 2, 3, 1)
+
+
+class StreamingVideoWriter:
+    '''
+    Encodes frames as they arrive instead of collecting the whole clip first.
+    The stream is opened lazily on the first write, once the frame size is known.
+    Codec setup mirrors torchvision.io.write_video so that the frame count and
+    timestamps of the output are the same. With time_base set, write() takes the
+    presentation timestamp of every frame in that unit, e.g. those of a source video.
+    '''
+    def __init__(self, path, fps=24, codec='libx264', options=None, time_base=None):
+        self.path = path
+        self.fps = fps
+        self.codec = codec
+        self.options = options if options is not None else {}
+        self.time_base = time_base
+        self.container = None
+        self.stream = None
+        self.frames_written = 0
+
+    def _open(self, height, width):
+        self.container = av.open(self.path, mode='w')
+        self.stream = self.container.add_stream(self.codec, rate=self.fps)
+        self.stream.width = width
+        self.stream.height = height
+        self.stream.pix_fmt = 'yuv420p' if self.codec != 'libx264rgb' else 'rgb24'
+        self.stream.options = self.options
+        if self.time_base is not None:
+            self.stream.codec_context.time_base = self.time_base
+
+    def write(self, frames, pts=None):
+        '''
+        frames = float NCHW tensor in [-1, 1] (any device), or uint8 NHWC tensor/ndarray
+        pts = timestamps of the frames in units of time_base, frames are evenly spaced at fps when None
+        '''
+        if torch.is_tensor(frames):
+            if frames.dtype != torch.uint8:
+                frames = tensor_to_uint8_frames(frames)
+            frames = frames.cpu().numpy()
+        if self.container is None:
+            self._open(frames.shape[1], frames.shape[2])
+        for i, img in enumerate(frames):
+            frame = av.VideoFrame.from_ndarray(np.ascontiguousarray(img), format='rgb24')
+            frame.pict_type = 'NONE'
+            if pts is not None:
+                frame.pts = int(pts[i])
+                frame.time_base = self.time_base
+            for packet in self.stream.encode(frame):
+                self.container.mux(packet)
+            self.frames_written += 1
+
+    def close(self):
+        if self.container is None: return
+        # Flush the encoder
+        for packet in self.stream.encode():
+            self.container.mux(packet)
+        self.container.close()
+        self.container = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class VideoFrameReader:
+    '''
+    Streams the frames of a video file without writing them out, decoding in FFmpeg's own threads.
+    Iterating yields (name, pts, uint8 CHW tensor) with pts in units of time_base, counted from the first frame.
+    resize takes the same 'flex;...' strings as ImageTensorConverter.
+    '''
+    def __init__(self, path, resize=None, threads=0):
+        self.path = path
+        self.resize = FlexResize(ResizeArgs.parse_from_string(resize)) if isinstance(resize, str) else resize
+        self.threads = threads
+        with av.open(path) as container:
+            stream = container.streams.video[0]
+            self.fps = stream.average_rate or stream.guessed_rate or 24
+            self.time_base = stream.time_base
+            # 0 when the container does not store it
+            self.num_frames = stream.frames
+
+    def __iter__(self):
+        with av.open(self.path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = 'AUTO'
+            if self.threads > 0:
+                stream.thread_count = self.threads
+            start = None
+            for i, frame in enumerate(container.decode(stream)):
+                pts = frame.pts if frame.pts is not None else round(i / (self.fps * self.time_base))
+                start = pts if start is None else start
+                x = frame.to_image()
+                if self.resize is not None:
+                    x = self.resize(x)
+                x = np.ascontiguousarray(np.asarray(x, dtype=np.uint8).transpose(2, 0, 1))
+                yield f'{i:06d}', pts - start, torch.from_numpy(x)
+
+    def head(self, count):
+        '''
+        The first count items, decoded by a container that is closed before returning
+        '''
+        with contextlib.closing(iter(self)) as frames:
+            return list(itertools.islice(frames, count))
+
+
+class SeekableVideo(torch.utils.data.Dataset):
+    '''
+    Random access to the frames of a video file for training. A packet index (timestamps and keyframes, no decoding)
+    is built once and saved as .<name>.index.json next to the video. Reading frame n seeks to the keyframe before it
+    and decodes up to n, only frame n is converted and resized. The decoder stays positioned after n, so a later read
+    further along the same GOP continues from there instead of seeking again, which makes sequential reads cheap.
+    The last cache_frames converted frames are kept. Items are uint8 CHW tensors like FrameStore ones.
+    '''
+    def __init__(self, path, resize=None, cache_frames=32):
+        self.path = path
+        self.resize = FlexResize(ResizeArgs.parse_from_string(resize)) if isinstance(resize, str) else resize
+        self.cache_frames = cache_frames
+        directory, name = os.path.split(os.path.abspath(path))
+        index_path = os.path.join(directory, f'.{name}.index.json')
+        st = os.stat(path)
+        source = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        index = None
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+        if index is None or index['source'] != source:
+            index = dict(self._build_index(), source=source)
+            tmp = f'{index_path}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp, index_path)
+        # presentation timestamps in frame order and the first frame of every GOP
+        self.pts = index['pts']
+        self.gop_starts = index['gop_starts']
+        self.frames = [f'{i:06d}' for i in range(len(self.pts))]
+        self.width, self.height = index['width'], index['height']
+        self._index_of = {pts: i for i, pts in enumerate(self.pts)}
+        self._container = None
+        # frames of the open decoder and the index of the next one it yields
+        self._decoder = None
+        self._position = None
+        self._cache = collections.OrderedDict()
+
+    def _build_index(self):
+        with av.open(self.path) as container:
+            stream = container.streams.video[0]
+            packets = [(packet.pts, packet.is_keyframe) for packet in container.demux(stream) if packet.pts is not None]
+            width, height = stream.codec_context.width, stream.codec_context.height
+        packets.sort()
+        gop_starts = [i for i, (_, keyframe) in enumerate(packets) if keyframe]
+        if len(gop_starts) == 0 or gop_starts[0] != 0:
+            gop_starts = [0] + gop_starts
+        return {'pts': [pts for pts, _ in packets], 'gop_starts': gop_starts, 'width': width, 'height': height}
+
+    def __getstate__(self):
+        # every worker process opens its own container and keeps its own frames
+        state = self.__dict__.copy()
+        state['_container'] = None
+        state['_decoder'] = None
+        state['_position'] = None
+        state['_cache'] = collections.OrderedDict()
+        return state
+
+    def __len__(self):
+        return len(self.pts)
+
+    def _gop_of(self, idx):
+        lo, hi = 0, len(self.gop_starts) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.gop_starts[mid] <= idx:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def _convert(self, frame):
+        x = frame.to_image()
+        if self.resize is not None:
+            x = self.resize(x)
+        return torch.from_numpy(np.ascontiguousarray(np.asarray(x, dtype=np.uint8).transpose(2, 0, 1)))
+
+    def _read(self, idx):
+        if self._container is None:
+            self._container = av.open(self.path)
+            self._container.streams.video[0].thread_type = 'AUTO'
+        stream = self._container.streams.video[0]
+        begin = self.gop_starts[self._gop_of(idx)]
+        # continue the open decoder when idx lies ahead of it with no keyframe in between, seek otherwise
+        if self._decoder is None or not begin <= self._position <= idx:
+            self._container.seek(self.pts[begin], stream=stream, backward=True, any_frame=False)
+            self._decoder = self._container.decode(stream)
+            self._position = begin
+        for frame in self._decoder:
+            i = self._index_of.get(frame.pts)
+            if i is None or i < idx:
+                # frames before idx are decoded as references but never converted
+                continue
+            self._position = i + 1
+            if i == idx:
+                return self._convert(frame)
+            break
+        self._decoder = None
+        raise RuntimeError(f"{self.path}: could not decode frame {idx}")
+
+    def __getitem__(self, idx):
+        x = self._cache.get(idx)
+        if x is None:
+            x = self._read(idx)
+            self._cache[idx] = x
+            if len(self._cache) > self.cache_frames:
+                self._cache.popitem(last=False)
+        self._cache.move_to_end(idx)
+        return x
+
+    def image(self, idx):
+        return Image.fromarray(self[idx].permute(1, 2, 0).numpy())
+
+
+def concat_videos(paths, output_path):
+    '''
+    Joins segments encoded with identical settings into one file without re-encoding.
+    Timestamps of each segment are shifted past the end of the previous one.
+    '''
+    with av.open(output_path, mode='w') as output:
+        out_stream = None
+        offset = 0
+        for path in paths:
+            with av.open(path) as segment:
+                in_stream = segment.streams.video[0]
+                if out_stream is None:
+                    out_stream = output.add_stream(template=in_stream)
+                frame_ticks = int(round(1 / (in_stream.average_rate * in_stream.time_base)))
+                end = offset
+                for packet in segment.demux(in_stream):
+                    # demux yields an empty packet to signal the end of the stream
+                    if packet.dts is None:
+                        continue
+                    packet.pts += offset
+                    packet.dts += offset
+                    end = max(end, packet.pts + (packet.duration or frame_ticks))
+                    packet.stream = out_stream
+                    output.mux(packet)
+                offset = end
@@ -0,0 +1,134 @@
+import torch
+import torch.nn as nn
+
+from futscml.models import SmoothUpsampleLayer
+
+
+class ImageToImageGenerator_JohnsonFutschik(nn.Module):
+    def __init__(self, norm_layer='batch_norm', use_bias=False, resnet_blocks=9, tanh=False,
+                 filters=(64, 128, 128, 128, 128, 64), input_channels=3, output_channels=3,
+                 append_blocks=None, blur_pool=False, conv_padding_mode='replicate',
+                 subpixel_upsample=False, config=None, **kwargs):
+        super().__init__()
+        assert norm_layer in [None, 'batch_norm', 'instance_norm']
+        self.norm_layer = None
+        if norm_layer == 'batch_norm':
+            self.norm_layer = nn.BatchNorm2d
+        elif norm_layer == 'instance_norm':
+            self.norm_layer = nn.InstanceNorm2d
+        self.use_bias = use_bias
+        self.blur_pool = blur_pool
+        self.conv_padding_mode = conv_padding_mode
+        self.config = config
+        self.use_attention = config['use_attention'] if 'use_attention' in config else False
+        self.resnet_blocks = resnet_blocks
+        self.append_blocks = append_blocks
+        self.subpixel_upsample = subpixel_upsample
+
+        self.conv0 = self.relu_layer(in_filters=input_channels, out_filters=filters[0],
+                                     size=7, stride=1, padding=3, bias=self.use_bias,
+                                     norm_layer=self.norm_layer, nonlinearity=nn.LeakyReLU(.2),
+                                     conv_padding_mode=self.conv_padding_mode)
+
+        self.conv1 = self.relu_layer(in_filters=filters[0], out_filters=filters[1],
+                                     size=3, stride=2, padding=1, bias=self.use_bias,
+                                     norm_layer=self.norm_layer, nonlinearity=nn.LeakyReLU(.2),
+                                     conv_padding_mode=self.conv_padding_mode)
+
+        self.conv2 = self.relu_layer(in_filters=filters[1], out_filters=filters[2],
+                                     size=3, stride=2, padding=1, bias=self.use_bias,
+                                     norm_layer=self.norm_layer, nonlinearity=nn.LeakyReLU(.2),
+                                     conv_padding_mode=self.conv_padding_mode)
+
+        self.resnets = nn.ModuleList()
+        for i in range(self.resnet_blocks):
+            self.resnets.append(
+                self.resnet_block(in_filters=filters[2], out_filters=filters[2],
+                                  size=3, stride=1, padding=1, bias=self.use_bias,
+                                  norm_layer=self.norm_layer, nonlinearity=nn.ReLU()))
+
+        self.upconv2 = self.upconv_layer(in_filters=filters[3] + filters[2], out_filters=filters[4],
+                                         norm_layer=self.norm_layer, nonlinearity=nn.ReLU())
+
+        self.upconv1 = self.upconv_layer(in_filters=filters[4] + filters[1], out_filters=filters[4],
+                                         norm_layer=self.norm_layer, nonlinearity=nn.ReLU())
+
+        self.conv_11 = nn.Sequential(
+            nn.Conv2d(filters[0] + filters[4] + input_channels, filters[5],
+                      kernel_size=7, stride=1, padding=3, bias=self.use_bias, padding_mode=self.conv_padding_mode),
+            nn.ReLU()
+        )
+
+        # initialize context to gaussian random noise
+        self.context = torch.randn(1, 100,
+                                   config['attention_context_dim'] if 'attention_context_dim' in config and config[
+                                       'attention_context_dim'] is not None else 1)
+
+        self.end_blocks = None
+        if self.append_blocks is not None:
+            self.end_blocks = nn.Sequential(
+                nn.Conv2d(filters[5], filters[5], kernel_size=3, bias=self.use_bias, padding=1,
+                          padding_mode=self.conv_padding_mode),
+                nn.ReLU(),
+                nn.BatchNorm2d(num_features=filters[5]),
+                nn.Conv2d(filters[5], filters[5], kernel_size=3, bias=self.use_bias, padding=1,
+                          padding_mode=self.conv_padding_mode),
+                nn.ReLU()
+            )
+
+        self.conv_12 = nn.Sequential(
+            nn.Conv2d(filters[5], output_channels, kernel_size=1, stride=1, padding=0, bias=True))
+        if tanh:
+            self.conv_12.add_module('tanh', nn.Tanh())
+
+    def forward(self, x):
+        output_0 = self.conv0(x)
+        output_1 = self.conv1(output_0)
+        output = self.conv2(output_1)
+        output_2 = self.conv2(output_1)
+        for layer in self.resnets:
+            output = layer(output) + output
+
+        output = self.upconv2(torch.cat((output, output_2), dim=1))
+        output = self.upconv1(torch.cat((output, output_1), dim=1))
+        output = self.conv_11(torch.cat((output, output_0, x), dim=1))
+        if self.end_blocks is not None:
+            output = self.end_blocks(output)
+        output = self.conv_12(output)
+        return output
+
+    def relu_layer(self, in_filters, out_filters, size, stride, padding, bias,
+                   norm_layer, nonlinearity, conv_padding_mode='replicate'):
+        out = []
+        out.append(nn.Conv2d(in_channels=in_filters, out_channels=out_filters,
+                             kernel_size=size, stride=stride, padding=padding, bias=bias,
+                             padding_mode=conv_padding_mode))
+        if norm_layer:
+            out.append(norm_layer(num_features=out_filters))
+        if nonlinearity:
+            out.append(nonlinearity)
+        return nn.Sequential(*out)
+
+    def resnet_block(self, in_filters, out_filters, size, stride, padding, bias,
+                     norm_layer, nonlinearity):
+        out = []
+        if nonlinearity:
+            out.append(nonlinearity)
+        out.append(nn.Conv2d(in_channels=in_filters, out_channels=out_filters,
+                             kernel_size=size, stride=stride, padding=padding, bias=bias))
+        if norm_layer:
+            out.append(norm_layer(num_features=out_filters))
+        if nonlinearity:
+            out.append(nonlinearity)
+        out.append(nn.Conv2d(in_channels=in_filters, out_channels=out_filters,
+                             kernel_size=size, stride=stride, padding=padding, bias=bias))
+        return nn.Sequential(*out)
+
+    def upconv_layer(self, in_filters, out_filters, norm_layer, nonlinearity):
+        out = []
+        out.append(SmoothUpsampleLayer(in_filters, out_filters, subpixel=self.subpixel_upsample))
+        if norm_layer:
+            out.append(norm_layer(num_features=out_filters))
+        if nonlinearity:
+            out.append(nonlinearity)
+        return nn.Sequential(*out)
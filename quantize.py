@@ -0,0 +1,127 @@
+from argparse import ArgumentParser
+import json
+import time
+
+import numpy as np
+import torch
+from tqdm import tqdm
+from skimage.metrics import structural_similarity
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    CalibrationMethod,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+
+from evaluate import load_config, load_generator, make_transform, prepare_input
+from export import export_onnx
+from futscml import *
+
+
+class FrameCalibrationReader(CalibrationDataReader):
+    '''
+    Streams evenly spaced frames of the target sequence to the calibrator, one at a time.
+    '''
+    def __init__(self, frames_dir, config, transform, num_frames, input_name='input'):
+        frames = images_in_directory(frames_dir)
+        stride = max(1, len(frames) // max(num_frames, 1))
+        self.paths = [os.path.join(frames_dir, f) for f in frames[::stride][:num_frames]]
+        self.config = config
+        self.transform = transform
+        self.input_name = input_name
+        self.iterator = iter(self.paths)
+
+    def get_next(self):
+        path = next(self.iterator, None)
+        if path is None:
+            return None
+        x = prepare_input(self.transform(pil_loader(path)).unsqueeze(0), self.config)
+        return {self.input_name: x.numpy()}
+
+    def rewind(self):
+        self.iterator = iter(self.paths)
+
+
+def compare_models(reference, candidate, frames_dir, config, transform, max_frames=None):
+    '''
+    Per clip timing and PSNR / SSIM of candidate vs reference outputs, both as uint8 frames.
+    '''
+    frames = images_in_directory(frames_dir)
+    if max_frames is not None:
+        frames = frames[:max_frames]
+    time_reference, time_candidate, psnrs, ssims = 0., 0., [], []
+    for frame in tqdm(frames, desc='Comparing'):
+        x = prepare_input(transform(pil_loader(os.path.join(frames_dir, frame))).unsqueeze(0), config)
+        begin = time.perf_counter()
+        y_reference = reference(x)
+        time_reference += time.perf_counter() - begin
+        begin = time.perf_counter()
+        y_candidate = candidate(x)
+        time_candidate += time.perf_counter() - begin
+        a = tensor_to_uint8_frames(y_reference)[0].numpy()
+        b = tensor_to_uint8_frames(y_candidate)[0].numpy()
+        psnrs.append(psnr(torch.from_numpy(a), torch.from_numpy(b), data_range=255.))
+        ssims.append(structural_similarity(a, b, channel_axis=2, data_range=255))
+    return {
+        'frames': len(frames),
+        'fps_fp32': len(frames) / time_reference,
+        'fps_int8': len(frames) / time_candidate,
+        'speedup': time_reference / time_candidate,
+        'psnr_mean': float(np.mean(psnrs)),
+        'psnr_min': float(np.min(psnrs)),
+        'ssim_mean': float(np.mean(ssims)),
+        'ssim_min': float(np.min(ssims)),
+    }
+
+
+if __name__ == "__main__":
+    p = ArgumentParser()
+    p.add_argument('checkpoint_dir', help='Checkpoint directory', type=str)
+    p.add_argument('checkpoint_filename', help='Network checkpoint', type=str)
+    p.add_argument('input_dir', help='Frames used for calibration and for the quality report', type=str)
+    p.add_argument('--onnx_path', default=None, type=str,
+                   help='fp32 model from export.py, exported on the fly if missing. Defaults to <checkpoint>.onnx')
+    p.add_argument('--output', default=None, type=str, help='Defaults to <checkpoint>.int8.onnx')
+    p.add_argument('--calibration_frames', default=32, type=int)
+    p.add_argument('--calibration_method', default='minmax', choices=['minmax', 'entropy', 'percentile'], type=str)
+    p.add_argument('--report_frames', default=None, type=int, help='Limit the quality report to the first N frames')
+    p.add_argument('--intra_op_threads', default=0, type=int)
+    argds = p.parse_args()
+
+    config = load_config(argds.checkpoint_dir)
+    config['device'] = 'cpu'
+    checkpoint = os.path.join(argds.checkpoint_dir, argds.checkpoint_filename)
+    stem = os.path.splitext(checkpoint)[0]
+    onnx_path = argds.onnx_path if argds.onnx_path is not None else stem + '.onnx'
+    output = argds.output if argds.output is not None else stem + '.int8.onnx'
+    transform = make_transform(config)
+
+    if not os.path.exists(onnx_path):
+        model = load_generator(config, checkpoint)
+        sample = prepare_input(transform(pil_loader(
+            os.path.join(argds.input_dir, images_in_directory(argds.input_dir)[0]))).unsqueeze(0), config)
+        with torch.no_grad():
+            export_onnx(model, sample, onnx_path)
+        print(f"Exported fp32 model to {onnx_path}")
+
+    reader = FrameCalibrationReader(argds.input_dir, config, transform, argds.calibration_frames)
+    calibration_method = {'minmax': CalibrationMethod.MinMax,
+                          'entropy': CalibrationMethod.Entropy,
+                          'percentile': CalibrationMethod.Percentile}[argds.calibration_method]
+    # Static PTQ of the convolutions only, per-channel int8 weights and uint8 activations
+    quantize_static(onnx_path, output, reader, quant_format=QuantFormat.QDQ, op_types_to_quantize=['Conv'],
+                    per_channel=True, weight_type=QuantType.QInt8, activation_type=QuantType.QUInt8,
+                    calibrate_method=calibration_method)
+    print(f"Wrote int8 model to {output}")
+
+    report = compare_models(OnnxRuntimeModel(onnx_path, intra_op_threads=argds.intra_op_threads),
+                            OnnxRuntimeModel(output, intra_op_threads=argds.intra_op_threads),
+                            argds.input_dir, config, transform, max_frames=argds.report_frames)
+    report.update({'input_dir': argds.input_dir, 'fp32_model': onnx_path, 'int8_model': output,
+                   'calibration_frames': len(reader.paths), 'calibration_method': argds.calibration_method})
+    with open(os.path.splitext(output)[0] + '.report.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"speedup {report['speedup']:.2f}x ({report['fps_fp32']:.2f} -> {report['fps_int8']:.2f} frames/s), "
+          f"PSNR mean {report['psnr_mean']:.2f} dB (min {report['psnr_min']:.2f}), "
+          f"SSIM mean {report['ssim_mean']:.4f} (min {report['ssim_min']:.4f})")
@@ -0,0 +1,179 @@
+from argparse import ArgumentParser
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import collections
+import io
+import json
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+
+from evaluate import load_config, load_generator, prepare_input
+from futscml import *
+
+
+class MicroBatcher:
+    '''
+    Coalesces concurrent single-frame requests into batches. The first waiting request opens a window of
+    max_delay seconds, frames of the same size that arrive within it (up to max_batch_size) share one forward pass.
+    submit() returns a Future with the uint8 HWC result.
+    '''
+    def __init__(self, model, config, max_batch_size=8, max_delay=0.005, history=10000):
+        self.model = model
+        self.config = config
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.latencies = collections.deque(maxlen=history)
+        self.counters = {'requests': 0, 'batches': 0, 'errors': 0}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        '''
+        frame = numpy uint8 HWC RGB
+        '''
+        future = Future()
+        self.requests.put((torch.from_numpy(frame).permute(2, 0, 1), future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0: break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            groups = collections.defaultdict(list)
+            for request in batch:
+                groups[tuple(request[0].shape)].append(request)
+            for group in groups.values():
+                self._forward(group)
+
+    def _forward(self, group):
+        try:
+            with torch.no_grad():
+                x = prepare_input(torch.stack([frame for frame, _, _ in group]), self.config)
+                y = tensor_to_uint8_frames(self.model(x)).cpu().numpy()
+        except Exception as e:
+            with self._lock:
+                self.counters['errors'] += len(group)
+            for _, future, _ in group:
+                future.set_exception(e)
+            return
+        now = time.perf_counter()
+        with self._lock:
+            self.counters['requests'] += len(group)
+            self.counters['batches'] += 1
+            self.latencies.extend(now - arrived for _, _, arrived in group)
+        for i, (_, future, _) in enumerate(group):
+            future.set_result(y[i])
+
+    def stats(self):
+        with self._lock:
+            ms = np.array(self.latencies) * 1000
+            counters = dict(self.counters)
+        uptime = time.perf_counter() - self.started
+        return dict(counters,
+                    p50_ms=float(np.percentile(ms, 50)) if len(ms) > 0 else None,
+                    p99_ms=float(np.percentile(ms, 99)) if len(ms) > 0 else None,
+                    mean_batch_size=counters['requests'] / max(counters['batches'], 1),
+                    frames_per_second=counters['requests'] / uptime,
+                    uptime_s=uptime)
+
+
+def make_handler(batcher):
+    class Handler(BaseHTTPRequestHandler):
+        '''
+        POST /stylize  body = PNG/JPEG image, or raw uint8 HWC RGB with X-Width and X-Height headers.
+                       The response uses the same encoding as the request.
+        GET  /stats    latency percentiles (server side, queueing included) and counters as json
+        '''
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, code, body, content_type, headers=None):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != '/stats':
+                return self._reply(404, b'not found', 'text/plain')
+            self._reply(200, json.dumps(batcher.stats()).encode('utf-8'), 'application/json')
+
+        def do_POST(self):
+            if self.path != '/stylize':
+                return self._reply(404, b'not found', 'text/plain')
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            raw = self.headers.get('Content-Type') == 'application/octet-stream'
+            try:
+                if raw:
+                    h, w = int(self.headers['X-Height']), int(self.headers['X-Width'])
+                    frame = np.frombuffer(bytearray(body), dtype=np.uint8).reshape(h, w, 3)
+                else:
+                    frame = pil_to_np(pilmage.open(io.BytesIO(body)).convert('RGB'))
+                if frame.shape[0] % 8 != 0 or frame.shape[1] % 8 != 0:
+                    raise ValueError(f"Frame sides must be divisible by 8, got {frame.shape[1]}x{frame.shape[0]}")
+            except Exception as e:
+                return self._reply(400, str(e).encode('utf-8'), 'text/plain')
+            try:
+                y = batcher.submit(frame).result()
+            except Exception as e:
+                return self._reply(500, str(e).encode('utf-8'), 'text/plain')
+            if raw:
+                return self._reply(200, y.tobytes(), 'application/octet-stream',
+                                   {'X-Height': str(y.shape[0]), 'X-Width': str(y.shape[1])})
+            buffer = io.BytesIO()
+            np_to_pil(y).save(buffer, format='PNG')
+            self._reply(200, buffer.getvalue(), 'image/png')
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    p = ArgumentParser()
+    p.add_argument('checkpoint_dir', help='Checkpoint directory', type=str)
+    p.add_argument('checkpoint_filename', help='Network checkpoint', type=str)
+    p.add_argument('--host', default='127.0.0.1', type=str)
+    p.add_argument('--port', default=8765, type=int)
+    p.add_argument('--device', default=None, type=str, help='Override the device from config.yml, e.g. cpu')
+    p.add_argument('--max_batch_size', default=8, type=int)
+    p.add_argument('--max_delay_ms', default=5., type=float,
+                   help='How long the first request of a batch waits for others to join it')
+    argds = p.parse_args()
+
+    config = load_config(argds.checkpoint_dir)
+    if argds.device is not None:
+        config['device'] = argds.device
+    model = load_generator(config, os.path.join(argds.checkpoint_dir, argds.checkpoint_filename))
+    if argds.max_batch_size > 1:
+        assert_batch_independent(model)
+
+    batcher = MicroBatcher(model, config, max_batch_size=argds.max_batch_size, max_delay=argds.max_delay_ms / 1000)
+    server = ThreadingHTTPServer((argds.host, argds.port), make_handler(batcher))
+    print(f"Serving on http://{argds.host}:{argds.port} (POST /stylize, GET /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
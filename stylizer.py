@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import torch
+
+from evaluate import load_config, load_generator
+
+
+class Stylizer:
+    '''
+    Keeps the frozen generator of a checkpoint resident for tools that stylize frame by frame.
+    Frames are numpy uint8 HWC RGB arrays with sides divisible by 8. The input and output tensors
+    are allocated once per resolution and reused, so a steady stream of same-sized frames does no
+    host allocations besides the model's own activations.
+
+        stylizer = Stylizer('data/Lili/checkpoints', 'checkpoint_best.pth')
+        out = stylizer(frame)  # uint8 HWC, overwritten by the next call unless out= is given
+    '''
+    def __init__(self, checkpoint_dir, checkpoint_filename, device=None, freeze=True, subpixel=True):
+        self.config = load_config(checkpoint_dir)
+        if device is not None:
+            self.config['device'] = device
+        self.device = torch.device(self.config['device'])
+        self.model = load_generator(self.config, os.path.join(checkpoint_dir, checkpoint_filename),
+                                    freeze=freeze, subpixel=subpixel)
+        self.input_channels = self.config['model_params']['input_channels']
+        self.shape = None
+
+    def _allocate(self, height, width):
+        pin = self.device.type == 'cuda'
+        self.input = torch.empty(1, self.input_channels, height, width, device=self.device)
+        if self.input_channels == 4:
+            self.input[:, :1] = 1
+        # pinned staging buffers make the host <-> device copies asynchronous DMA transfers
+        self.staging = torch.empty(height, width, 3, dtype=torch.uint8, pin_memory=pin)
+        # device side of the upload, reused like the input so a frame allocates nothing
+        self.upload = torch.empty(height, width, 3, dtype=torch.uint8, device=self.device) if pin else None
+        self.output = torch.empty(height, width, 3, dtype=torch.uint8, pin_memory=pin)
+        self.shape = (height, width)
+
+    def __call__(self, frame, out=None):
+        '''
+        frame = numpy uint8 HWC RGB, out = optional uint8 HWC array of the same shape to write into
+        '''
+        height, width = frame.shape[:2]
+        if height % 8 != 0 or width % 8 != 0:
+            raise ValueError(f"Frame sides must be divisible by 8, got {width}x{height}")
+        if (height, width) != self.shape:
+            self._allocate(height, width)
+        # shares memory with the numpy array
+        x = torch.from_numpy(frame)
+        if self.device.type == 'cuda':
+            x = self.upload.copy_(self.staging.copy_(x), non_blocking=True)
+        rgb = self.input[:, -3:]
+        rgb.copy_(x.permute(2, 0, 1).unsqueeze(0))
+        rgb.div_(255).sub_(0.5).div_(0.5)
+        with torch.no_grad():
+            y = self.model(self.input)
+        # same rounding as tensor_to_uint8_frames, the cast truncates
+        y = y[0].clamp_(-1, 1).mul_(127.5).add_(127.5).permute(1, 2, 0)
+        self.output.copy_(y)
+        if out is not None:
+            np.copyto(out, self.output.numpy())
+            return out
+        return self.output.numpy()
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+import torch
+import torch.nn as nn
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the top-level scripts (generator.py, evaluate.py) are imported as modules
+sys.path.insert(0, ROOT)
+
+
+def randomize_batch_norms(model):
+    # non-trivial running statistics and affine parameters, so folding them is actually exercised
+    for module in model.modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.running_mean.uniform_(-.5, .5)
+            module.running_var.uniform_(.5, 2.)
+            module.weight.data.uniform_(.5, 1.5)
+            module.bias.data.uniform_(-.5, .5)
+    return model
+
+
+@pytest.fixture
+def lili_config():
+    with open(os.path.join(ROOT, 'confs', 'lili.yml'), 'r') as f:
+        config = yaml.safe_load(f)
+    config['device'] = 'cpu'
+    return config
+
+
+@pytest.fixture
+def make_generator(lili_config):
+    '''
+    The generator evaluate.py loads, built from confs/lili.yml with randomized BatchNorm statistics
+    '''
+    from generator import ImageToImageGenerator_JohnsonFutschik
+
+    def make(**overrides):
+        torch.manual_seed(0)
+        params = dict(lili_config['model_params'], **overrides)
+        model = ImageToImageGenerator_JohnsonFutschik(config=lili_config, **params)
+        return randomize_batch_norms(model).eval()
+    return make
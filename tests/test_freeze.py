@@ -0,0 +1,20 @@
+import pytest
+import torch
+
+from futscml import freeze_for_inference
+
+
+@pytest.mark.parametrize('subpixel', [False, True])
+def test_frozen_generator_matches_training_module(make_generator, subpixel):
+    model = make_generator()
+    x = torch.rand(2, 3, 64, 96) * 2 - 1
+    with torch.no_grad():
+        expected = model.eval()(x)
+        frozen = freeze_for_inference(model, subpixel=subpixel)(x)
+    assert torch.allclose(frozen, expected, atol=1e-4), (frozen - expected).abs().max()
+
+
+def test_frozen_generator_has_no_batch_norms(make_generator):
+    frozen = freeze_for_inference(make_generator())
+    assert not any(isinstance(m, torch.nn.BatchNorm2d) for m in frozen.modules())
+    assert not any(p.requires_grad for p in frozen.parameters())
@@ -0,0 +1,44 @@
+import pytest
+import torch
+import torch.nn as nn
+from einops import repeat
+
+from futscml import PackedGramMSELoss
+from futscml.futscml import GramMatrix
+
+
+def features(n, seed):
+    # two layers of the same shape (one shared bmm), one with the same channel count at another size, one wider
+    g = torch.Generator().manual_seed(seed)
+    shapes = [(8, 12, 12), (8, 12, 12), (8, 6, 6), (16, 6, 6)]
+    return [torch.randn(n, *shape, generator=g, dtype=torch.float64) for shape in shapes]
+
+
+def loop_loss(feat_frame_y, feat_pure_y):
+    # the per-layer loop PackedGramMSELoss replaced in InnerProductLoss.run_scale
+    gmm, dist = GramMatrix(), nn.MSELoss()
+    gmm_pure_y = [gmm(f) for f in feat_pure_y]
+    loss = torch.empty((len(feat_frame_y),), dtype=torch.float64)
+    for l in range(len(feat_frame_y)):
+        gmm_frame_y = gmm(feat_frame_y[l])
+        if gmm_frame_y.shape[0] != gmm_pure_y[l].shape[0]:
+            # patches: one frame against a batch of keyframe patches
+            gmm_frame_y = repeat(gmm_frame_y, '1 h w -> c h w', c=gmm_pure_y[l].shape[0])
+        loss[l] = dist(gmm_pure_y[l].detach(), gmm_frame_y)
+    return torch.sum(loss)
+
+
+@pytest.mark.parametrize('frame_n, pure_n', [(1, 1), (2, 2), (1, 3)])
+def test_packed_gram_loss_matches_loop(frame_n, pure_n):
+    fused = PackedGramMSELoss()
+    feat_pure_y = features(pure_n, seed=1)
+    feat_frame_y = [f.requires_grad_() for f in features(frame_n, seed=0)]
+
+    reference = loop_loss(feat_frame_y, feat_pure_y)
+    reference_grad = torch.autograd.grad(reference, feat_frame_y)
+    value = fused(feat_frame_y, fused.pack(feat_pure_y))
+    value_grad = torch.autograd.grad(value, feat_frame_y)
+
+    torch.testing.assert_close(value, reference)
+    for a, b in zip(value_grad, reference_grad):
+        torch.testing.assert_close(a, b)
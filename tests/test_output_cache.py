@@ -0,0 +1,34 @@
+import os
+
+import numpy as np
+
+from futscml import OutputCache
+
+
+def frame(value):
+    return np.full((64, 64, 3), value, dtype=np.uint8)
+
+
+def test_output_cache_evicts_least_recently_used(tmp_path):
+    entry = OutputCache(str(tmp_path)).put('probe', frame(0))
+    entry_bytes = os.path.getsize(tmp_path / 'probe.npy')
+    os.remove(tmp_path / 'probe.npy')
+
+    cache = OutputCache(str(tmp_path), memory_entries=0, max_bytes=3 * entry_bytes)
+    for key in 'abc':
+        cache.put(key, frame(ord(key)))
+    assert cache.get('a') is not None
+    cache.put('d', frame(ord('d')))
+
+    assert sorted(os.listdir(tmp_path)) == ['a.npy', 'c.npy', 'd.npy']
+    assert cache.evictions == 1 and cache.bytes == 3 * entry_bytes
+    assert cache.get('b') is None
+    np.testing.assert_array_equal(cache.get('d'), frame(ord('d')))
+
+
+def test_output_cache_reopens_with_existing_entries(tmp_path):
+    OutputCache(str(tmp_path)).put('a', frame(1))
+    cache = OutputCache(str(tmp_path), memory_entries=0)
+    assert cache.bytes == os.path.getsize(tmp_path / 'a.npy')
+    np.testing.assert_array_equal(cache.get('a'), frame(1))
+    assert not any(name.endswith('.tmp') for name in os.listdir(tmp_path))
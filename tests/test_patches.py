@@ -0,0 +1,56 @@
+import pytest
+import torch
+from einops import rearrange
+
+from futscml import gather_patches
+
+
+def loop_patches(img, coords, size):
+    # the per-patch slicing loop PatchSampler.cut_patches used before gather_patches
+    stacked = torch.stack([img[..., y:y + size, x:x + size] for (y, x) in coords], dim=2)
+    return rearrange(stacked, 'b c n k1 k2 -> (b n) c k1 k2')
+
+
+def images(batch):
+    g = torch.Generator().manual_seed(0)
+    # two of the same size are gathered together, the third (other batch) on its own
+    return [torch.randn(batch, 3, 21, 17, generator=g), torch.randn(batch, 1, 21, 17, generator=g),
+            torch.randint(0, 256, (batch + 1, 3, 21, 17), generator=g, dtype=torch.uint8)]
+
+
+@pytest.mark.parametrize('batch', [1, 3])
+@pytest.mark.parametrize('size', [1, 5, 8])
+def test_gather_patches_matches_slicing(batch, size):
+    xs = images(batch)
+    h, w = xs[0].shape[-2:]
+    # all four corners, so patches touch every edge, and a few interior positions
+    coords = torch.tensor([[0, 0], [0, w - size], [h - size, 0], [h - size, w - size], [3, 7], [h // 2, 1]])
+    patches = gather_patches(xs, coords[:, 0], coords[:, 1], size)
+    for x, p in zip(xs, patches):
+        assert p.dtype == x.dtype
+        torch.testing.assert_close(p, loop_patches(x, coords, size), rtol=0, atol=0)
+    torch.testing.assert_close(gather_patches(xs[0], coords[:, 0], coords[:, 1], size),
+                               loop_patches(xs[0], coords, size), rtol=0, atol=0)
+
+
+def test_patch_sampler_matches_slicing_loop():
+    train = pytest.importorskip('train')
+
+    class LoopPatchSampler(train.PatchSampler):
+        def cut_patches(self, images):
+            if self._positions is None or self._ptr + self.num_patches > self._positions.size(0):
+                self._init_perm(images[0])
+            coords = self._positions[self._ptr:self._ptr + self.num_patches]
+            self._ptr += self.num_patches
+            return [loop_patches(img, coords, self.ps) for img in images]
+
+    xs = images(2)[:2]
+    torch.manual_seed(0)
+    sampler = train.PatchSampler(patch_size=7, num_patches=5)
+    # 15 x 11 positions, enough calls to run out of them and reshuffle
+    outputs = [sampler.cut_patches(xs) for _ in range(40)]
+    torch.manual_seed(0)
+    reference = LoopPatchSampler(patch_size=7, num_patches=5)
+    for out in outputs:
+        for p, r in zip(out, reference.cut_patches(xs)):
+            torch.testing.assert_close(p, r, rtol=0, atol=0)
@@ -0,0 +1,30 @@
+import os
+
+import av
+import torch
+
+from futscml import StreamingVideoWriter
+from evaluate import merge_segments, segment_path, shard_range
+
+
+def test_shard_ranges_cover_frames_with_more_shards_than_frames():
+    ranges = [shard_range(3, i, 5) for i in range(5)]
+    assert [i for begin, end in ranges for i in range(begin, end)] == [0, 1, 2]
+    assert sum(1 for begin, end in ranges if begin == end) == 2
+
+
+def test_merge_skips_empty_shards(tmp_path):
+    num_frames, num_shards = 3, 5
+    for i in range(num_shards):
+        begin, end = shard_range(num_frames, i, num_shards)
+        path = segment_path(str(tmp_path), i, num_shards)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # what a shard writes, nothing at all when its range is empty
+        with StreamingVideoWriter(path, fps=24) as writer:
+            for _ in range(begin, end):
+                writer.write(torch.zeros(1, 3, 64, 64))
+
+    merge_segments(str(tmp_path), num_shards, num_frames)
+
+    with av.open(str(tmp_path / 'output.mp4')) as container:
+        assert sum(1 for _ in container.decode(video=0)) == num_frames
@@ -0,0 +1,56 @@
+import pytest
+import torch
+
+from futscml.models import SmoothUpsampleLayer, SubPixelUpsampleLayer
+
+
+@pytest.mark.parametrize('padding_mode', ['zeros', 'replicate', 'circular'])
+@pytest.mark.parametrize('bias', [False, True])
+def test_subpixel_upsample_matches_nearest_conv(padding_mode, bias):
+    torch.manual_seed(0)
+    layer = SmoothUpsampleLayer(16, 8, bias=bias, padding_mode=padding_mode).eval()
+    converted = SubPixelUpsampleLayer.from_smooth_upsample(layer)
+    x = torch.randn(2, 16, 7, 10)
+    with torch.no_grad():
+        expected = layer(x)
+        layer.subpixel = True
+        assert torch.allclose(layer(x), expected, atol=1e-5)
+        assert torch.allclose(converted(x), expected, atol=1e-5)
+
+
+@pytest.mark.parametrize('padding_mode', ['zeros', 'replicate', 'circular'])
+def test_subpixel_upsample_training_gradients(padding_mode):
+    torch.manual_seed(0)
+    reference = SmoothUpsampleLayer(16, 8, bias=True, padding_mode=padding_mode)
+    layer = SmoothUpsampleLayer(16, 8, bias=True, padding_mode=padding_mode, subpixel=True)
+    # same parameters either way
+    layer.load_state_dict(reference.state_dict())
+    x = torch.randn(2, 16, 7, 10)
+    x_reference, x_layer = x.clone().requires_grad_(), x.clone().requires_grad_()
+    target = torch.randn(2, 8, 14, 20)
+
+    expected = reference(x_reference)
+    y = layer(x_layer)
+    assert torch.allclose(y, expected, atol=1e-5)
+    ((expected - target) ** 2).mean().backward()
+    ((y - target) ** 2).mean().backward()
+    assert torch.allclose(x_layer.grad, x_reference.grad, atol=1e-5)
+    assert torch.allclose(layer.conv.weight.grad, reference.conv.weight.grad, atol=1e-5)
+    assert torch.allclose(layer.conv.bias.grad, reference.conv.bias.grad, atol=1e-5)
+
+
+@pytest.mark.parametrize('freeze', [False, True])
+def test_checkpoint_loads_with_subpixel_upsample(make_generator, lili_config, tmp_path, freeze):
+    from evaluate import load_generator
+
+    model = make_generator(subpixel_upsample=False)
+    path = tmp_path / 'checkpoint.pth'
+    torch.save({'state_dict': model.state_dict()}, path)
+    lili_config['model_params']['subpixel_upsample'] = True
+    loaded = load_generator(lili_config, str(path), freeze=freeze)
+    if not freeze:
+        assert all(layer.subpixel for layer in loaded.modules() if isinstance(layer, SmoothUpsampleLayer))
+
+    x = torch.rand(1, 3, 64, 96) * 2 - 1
+    with torch.no_grad():
+        assert torch.allclose(loaded(x), model(x), atol=1e-4)
@@ -0,0 +1,27 @@
+import pytest
+import torch
+
+from futscml import assert_tileable, freeze_for_inference, receptive_field_radius, tiled_forward
+
+
+def test_tiled_forward_matches_whole_frame(make_generator):
+    model = freeze_for_inference(make_generator())
+    # rounded up to the downsampling grid like evaluate.py does
+    halo = -(-receptive_field_radius(model, 3) // 8) * 8
+    tile = 2 * halo + 48
+    x = torch.rand(1, 3, tile + 64, tile + 128) * 2 - 1
+    with torch.no_grad():
+        expected = model(x)
+        tiled = tiled_forward(model, x, tile_size=tile, halo=halo, feather=16, batch_size=4)
+    assert torch.allclose(tiled, expected, atol=1e-4), (tiled - expected).abs().max()
+
+
+def test_instance_norm_generator_is_refused(make_generator):
+    # confs/lili_full_frame.yml, every tile would be normalized by its own statistics
+    model = make_generator(norm_layer='instance_norm')
+    with pytest.raises(ValueError):
+        assert_tileable(model)
+    with pytest.raises(ValueError):
+        receptive_field_radius(model, 3)
+    with pytest.raises(ValueError), torch.no_grad():
+        tiled_forward(model, torch.rand(1, 3, 128, 128), tile_size=64, halo=16, feather=8)
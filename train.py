@@ -1,5 +1,7 @@
 import random
 import os
+import pickle
+import time
 from contextlib import suppress as suppress
 from argparse import ArgumentParser
 
@@ -16,7 +18,8 @@ from torchvision.transforms import functional as Tfunc
 from torchvision.models import VGG19_Weights, VGG19_BN_Weights
 from tqdm import tqdm
 from omegaconf import OmegaConf
-from einops import repeat, rearrange
+from einops import rearrange
+from PIL import Image
 from controlnet_aux import LineartDetector
 
 from futscml import (
@@ -27,141 +30,20 @@ from futscml import (
     InfiniteDatasetSampler,
     ValueAnnealing,
     TensorboardLogger,
+    FrameStore,
+    normalize_frames,
+    SeekableVideo,
+    is_video_file,
+    gather_patches,
+    PackedGramMSELoss,
+    config_digest,
+    tensor_digest,
 )
 from futscml.stopwatch import Stopwatch
 from futscml.util import HWC3
-from futscml.models import SmoothUpsampleLayer
 from futscml.sds import SDSControlNet
-from futscml.futscml import GramMatrix, guess_model_device, pil_to_np
-
-
-class ImageToImageGenerator_JohnsonFutschik(nn.Module):
-    def __init__(self, norm_layer='batch_norm', use_bias=False, resnet_blocks=9, tanh=False,
-                 filters=(64, 128, 128, 128, 128, 64), input_channels=3, output_channels=3,
-                 append_blocks=None, blur_pool=False, conv_padding_mode='replicate',
-                 config=None, **kwargs):
-        super().__init__()
-        assert norm_layer in [None, 'batch_norm', 'instance_norm']
-        self.norm_layer = None
-        if norm_layer == 'batch_norm':
-            self.norm_layer = nn.BatchNorm2d
-        elif norm_layer == 'instance_norm':
-            self.norm_layer = nn.InstanceNorm2d
-        self.use_bias = use_bias
-        self.blur_pool = blur_pool
-        self.conv_padding_mode = conv_padding_mode
-        self.config = config
-        self.use_attention = config['use_attention'] if 'use_attention' in config else False
-        self.resnet_blocks = resnet_blocks
-        self.append_blocks = append_blocks
-
-        self.conv0 = self.relu_layer(in_filters=input_channels, out_filters=filters[0],
-                                     size=7, stride=1, padding=3, bias=self.use_bias,
-                                     norm_layer=self.norm_layer, nonlinearity=nn.LeakyReLU(.2),
-                                     conv_padding_mode=self.conv_padding_mode)
-
-        self.conv1 = self.relu_layer(in_filters=filters[0], out_filters=filters[1],
-                                     size=3, stride=2, padding=1, bias=self.use_bias,
-                                     norm_layer=self.norm_layer, nonlinearity=nn.LeakyReLU(.2),
-                                     conv_padding_mode=self.conv_padding_mode)
-
-        self.conv2 = self.relu_layer(in_filters=filters[1], out_filters=filters[2],
-                                     size=3, stride=2, padding=1, bias=self.use_bias,
-                                     norm_layer=self.norm_layer, nonlinearity=nn.LeakyReLU(.2),
-                                     conv_padding_mode=self.conv_padding_mode)
-
-        self.resnets = nn.ModuleList()
-        for i in range(self.resnet_blocks):
-            self.resnets.append(
-                self.resnet_block(in_filters=filters[2], out_filters=filters[2],
-                                  size=3, stride=1, padding=1, bias=self.use_bias,
-                                  norm_layer=self.norm_layer, nonlinearity=nn.ReLU()))
-
-        self.upconv2 = self.upconv_layer(in_filters=filters[3] + filters[2], out_filters=filters[4],
-                                         norm_layer=self.norm_layer, nonlinearity=nn.ReLU())
-
-        self.upconv1 = self.upconv_layer(in_filters=filters[4] + filters[1], out_filters=filters[4],
-                                         norm_layer=self.norm_layer, nonlinearity=nn.ReLU())
-
-        self.conv_11 = nn.Sequential(
-            nn.Conv2d(filters[0] + filters[4] + input_channels, filters[5],
-                      kernel_size=7, stride=1, padding=3, bias=self.use_bias, padding_mode=self.conv_padding_mode),
-            nn.ReLU()
-        )
-
-        # initialize context to gaussian random noise
-        self.context = torch.randn(1, 100,
-                                   config['attention_context_dim'] if 'attention_context_dim' in config and config[
-                                       'attention_context_dim'] is not None else 1)
-
-        self.end_blocks = None
-        if self.append_blocks is not None:
-            self.end_blocks = nn.Sequential(
-                nn.Conv2d(filters[5], filters[5], kernel_size=3, bias=self.use_bias, padding=1,
-                          padding_mode=self.conv_padding_mode),
-                nn.ReLU(),
-                nn.BatchNorm2d(num_features=filters[5]),
-                nn.Conv2d(filters[5], filters[5], kernel_size=3, bias=self.use_bias, padding=1,
-                          padding_mode=self.conv_padding_mode),
-                nn.ReLU()
-            )
-
-        self.conv_12 = nn.Sequential(
-            nn.Conv2d(filters[5], output_channels, kernel_size=1, stride=1, padding=0, bias=True))
-        if tanh:
-            self.conv_12.add_module('tanh', nn.Tanh())
-
-    def forward(self, x):
-        output_0 = self.conv0(x)
-        output_1 = self.conv1(output_0)
-        output = self.conv2(output_1)
-        output_2 = self.conv2(output_1)
-        for layer in self.resnets:
-            output = layer(output) + output
-
-        output = self.upconv2(torch.cat((output, output_2), dim=1))
-        output = self.upconv1(torch.cat((output, output_1), dim=1))
-        output = self.conv_11(torch.cat((output, output_0, x), dim=1))
-        if self.end_blocks is not None:
-            output = self.end_blocks(output)
-        output = self.conv_12(output)
-        return output
-
-    def relu_layer(self, in_filters, out_filters, size, stride, padding, bias,
-                   norm_layer, nonlinearity, conv_padding_mode='replicate'):
-        out = []
-        out.append(nn.Conv2d(in_channels=in_filters, out_channels=out_filters,
-                             kernel_size=size, stride=stride, padding=padding, bias=bias,
-                             padding_mode=conv_padding_mode))
-        if norm_layer:
-            out.append(norm_layer(num_features=out_filters))
-        if nonlinearity:
-            out.append(nonlinearity)
-        return nn.Sequential(*out)
-
-    def resnet_block(self, in_filters, out_filters, size, stride, padding, bias,
-                     norm_layer, nonlinearity):
-        out = []
-        if nonlinearity:
-            out.append(nonlinearity)
-        out.append(nn.Conv2d(in_channels=in_filters, out_channels=out_filters,
-                             kernel_size=size, stride=stride, padding=padding, bias=bias))
-        if norm_layer:
-            out.append(norm_layer(num_features=out_filters))
-        if nonlinearity:
-            out.append(nonlinearity)
-        out.append(nn.Conv2d(in_channels=in_filters, out_channels=out_filters,
-                             kernel_size=size, stride=stride, padding=padding, bias=bias))
-        return nn.Sequential(*out)
-
-    def upconv_layer(self, in_filters, out_filters, norm_layer, nonlinearity):
-        out = []
-        out.append(SmoothUpsampleLayer(in_filters, out_filters))
-        if norm_layer:
-            out.append(norm_layer(num_features=out_filters))
-        if nonlinearity:
-            out.append(nonlinearity)
-        return nn.Sequential(*out)
+from futscml.futscml import guess_model_device, pil_to_np
+from generator import ImageToImageGenerator_JohnsonFutschik
 
 
 class ImageLoss(nn.Module):
@@ -176,17 +58,19 @@ class ImageLoss(nn.Module):
 class Vgg19_Extractor(nn.Module):
     def __init__(self, capture_layers):
         super().__init__()
-        self.vgg_layers = models.vgg19(weights=VGG19_Weights.IMAGENET1K_V1)
+        vgg = models.vgg19(weights=VGG19_Weights.IMAGENET1K_V1)
         # Load the old model if requested
-        # self.vgg_layers.load_state_dict(torch.load('/home/futscdav/model_vault/old_vgg_converted_new_transform.pth'))
-        self.vgg_layers = self.vgg_layers.features
-        self.len_layers = 37  # len(self.vgg_layers)
+        # vgg.load_state_dict(torch.load('/home/futscdav/model_vault/old_vgg_converted_new_transform.pth'))
+        # only the modules up to the deepest captured layer are kept, the classifier and the tail are freed
+        self.len_layers = max([0] + [l for l in capture_layers if l > 0])
+        self.vgg_layers = vgg.features[:self.len_layers]
+        del vgg
 
         for param in self.parameters():
             param.requires_grad = False
         self.capture_layers = capture_layers
 
-    def forward(self, x):
+    def _forward(self, x):
         feat = []
         if -1 in self.capture_layers:
             feat.append(x)
@@ -198,77 +82,143 @@ class Vgg19_Extractor(nn.Module):
                 feat.append(x)
         return feat
 
+    def forward(self, *xs):
+        '''
+        Features of one input, or a list of features per input when given several. Inputs of the same size
+        go through the network as one batch.
+        '''
+        if len(xs) == 1:
+            return self._forward(xs[0])
+        if len(set(tuple(x.shape[1:]) for x in xs)) > 1:
+            return [self._forward(x) for x in xs]
+        sizes = [x.shape[0] for x in xs]
+        feat = [f.split(sizes, dim=0) for f in self._forward(torch.cat(xs, dim=0))]
+        return [list(per_input) for per_input in zip(*feat)]
+
+
+class GramTargetCache:
+    '''
+    Packed keyframe Gram matrices (PackedGramMSELoss.pack) by key, held on the device and, with a directory,
+    persisted as one .pt file per key so later runs load them instead of running VGG on the keyframes
+    '''
+    def __init__(self, directory, device):
+        self.directory = directory
+        self.device = device
+        self.memory = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pt')
+
+    def get(self, key):
+        if key not in self.memory and self.directory is not None and os.path.exists(self._path(key)):
+            try:
+                packed = torch.load(self._path(key), map_location='cpu')
+            except (OSError, RuntimeError, EOFError, pickle.UnpicklingError) as e:
+                # a corrupt or vanished file is only a miss, the targets are computed again and rewritten
+                print(f"Ignoring cached Gram targets {self._path(key)}: {e}")
+                return None
+            self.memory[key] = {c: t.to(self.device) for c, t in packed.items()}
+        return self.memory.get(key)
+
+    def put(self, key, packed):
+        self.memory[key] = packed
+        if self.directory is None: return
+        # written aside and renamed, so an interrupted run leaves no truncated file behind,
+        # per process so runs sharing the directory never write the same temp file
+        tmp = f'{self._path(key)}.{os.getpid()}.tmp'
+        torch.save({c: t.cpu() for c, t in packed.items()}, tmp)
+        os.replace(tmp, self._path(key))
+
 
 class InnerProductLoss(nn.Module):
-    def __init__(self, capture_layers, device):
+    def __init__(self, capture_layers, device, scales=(1.,), cache_dir=None):
         super().__init__()
         self.layers = capture_layers
         self.device = device
+        self.scales = [float(s) for s in scales]
         self.vgg = Vgg19_Extractor(capture_layers).to(device)
         self.stored_mean = (torch.Tensor([0.485, 0.456, 0.406]).to(device).view(1, -1, 1, 1))
         self.stored_std = (torch.Tensor([0.229, 0.224, 0.225]).to(device).view(1, -1, 1, 1))
-        self.gmm = GramMatrix()
-        self.dist = nn.MSELoss()
-        self.cache: Dict[float, List[torch.Tensor]] = {0.: [torch.empty((0))]}  # torch.Tensor
+        self.gram_loss = PackedGramMSELoss()
+        self.cache = GramTargetCache(cache_dir, device)  # packed keyframe Grams per keyframe and scale
         self.attention_layers = []
 
-    def extractor(self, x):
+    def extractor(self, *xs):
         # remap x to vgg range
-        x = (x + 1.) / 2.
-        x = x - self.stored_mean
-        x = x / self.stored_std
-        res = self.vgg(x)
+        xs = [((x + 1.) / 2. - self.stored_mean) / self.stored_std for x in xs]
+        res = self.vgg(*xs)
         return res
 
-    def run_scale(self, frame_y, pure_y, cache_y2: bool = True, scale: float = 1.):
+    def target_key(self, keyframe_digest, scale):
+        # the digest is taken from the resized keyframe tensor, so the resize is part of the key
+        return config_digest({'keyframe': keyframe_digest, 'layers': list(self.layers), 'scale': float(scale),
+                              'vgg': 'vgg19/IMAGENET1K_V1'})
+
+    def precompute(self, keyframe_digest, pure_y):
+        '''
+        Gram targets of one keyframe (1CHW) at every scale, loaded from the cache directory when present
+        '''
+        for scale in self.scales:
+            key = self.target_key(keyframe_digest, scale)
+            if self.cache.get(key) is not None: continue
+            with torch.no_grad():
+                pure = F.interpolate(pure_y, scale_factor=scale, mode='bilinear', align_corners=False)
+                self.cache.put(key, self.gram_loss.pack(self.extractor(pure)))
+
+    def run_scale(self, frame_y, pure_y, keys=None, scale: float = 1.):
         frame_y = F.interpolate(frame_y, scale_factor=float(scale), mode='bilinear', align_corners=False,
                                 recompute_scale_factor=False)
-        feat_frame_y = self.extractor(frame_y)
-        if cache_y2:
-            if scale not in self.cache:
-                pure_y = F.interpolate(pure_y, scale_factor=scale, mode='bilinear', align_corners=False)
-                self.cache[scale] = [self.gmm(l) for idx, l in enumerate(self.extractor(pure_y))]
-            gmm_pure_y = self.cache[scale]
+        targets = None if keys is None else [self.cache.get(self.target_key(k, scale)) for k in keys]
+        if targets is not None and all(t is not None for t in targets):
+            feat_frame_y = self.extractor(frame_y)
         else:
+            # targets that are not cached share the forward pass with the frame
             pure_y = F.interpolate(pure_y, scale_factor=scale, mode='bilinear', align_corners=False)
-            feat_pure_y = self.extractor(pure_y)
-            gmm_pure_y = [self.gmm(l) for idx, l in enumerate(feat_pure_y)]
-
-        loss = torch.empty((len(feat_frame_y),)).to(frame_y.device)
-        for l in range(len(feat_frame_y)):
-            gmm_frame_y = self.gmm(feat_frame_y[l])
-            if config.use_patches:
-                gmm_frame_y = repeat(gmm_frame_y, '1 h w -> c h w', c=gmm_pure_y[l].shape[0])
-            assert gmm_pure_y[l].shape[0] == gmm_frame_y.shape[0]
-            assert not (gmm_pure_y[l].requires_grad)
-            dist = self.dist(gmm_pure_y[l].detach(), gmm_frame_y)
-            loss[l] = dist
-        return torch.sum(loss)
-
-    def forward(self, frame_y, pure_y, cache_y2: bool = True):
-        scale_1_loss = self.run_scale(frame_y, pure_y, cache_y2, scale=1.0)
-        # scale_2_loss = self.run_scale(y1, y2, cache_y2, scale=0.5)
-        return scale_1_loss
+            feat_frame_y, feat_pure_y = self.extractor(frame_y, pure_y)
+            feat_pure_y = [f.detach() for f in feat_pure_y]
+            if keys is None:
+                return self.gram_loss(feat_frame_y, self.gram_loss.pack(feat_pure_y))
+            targets = [self.gram_loss.pack([f[i:i + 1] for f in feat_pure_y]) for i in range(len(keys))]
+            for k, packed in zip(keys, targets):
+                self.cache.put(self.target_key(k, scale), packed)
+        gmm_pure_y = {c: torch.cat([packed[c] for packed in targets], dim=1) for c in targets[0]}
+
+        # sum over layers of MSE(gram(pure_y), gram(frame_y)), a single frame broadcasts against all keyframes
+        return self.gram_loss(feat_frame_y, gmm_pure_y)
+
+    def forward(self, frame_y, pure_y, cache_y2: bool = True, keys=None):
+        '''
+        keys = content digests of the keyframes in pure_y, hashed here when not given
+        '''
+        if cache_y2 and keys is None:
+            keys = [tensor_digest(p) for p in pure_y]
+        # only the generated side is extracted per scale once the targets are cached
+        return torch.stack([self.run_scale(frame_y, pure_y, keys if cache_y2 else None, scale=s)
+                            for s in self.scales]).sum()
 
 
 class InferDataset(Dataset):
-    def __init__(self, frames_dir, xform):
+    def __init__(self, frames_dir, resize):
+        # uint8 frames from a memory-mapped store or a video file, normalize_frames them on the device
         self.root = os.path.join(frames_dir)
-        self.frames = images_in_directory(self.root)
-        self.tensors = []
-        self.stems = []
-        self.xform = xform
-        for frame in self.frames:
-            stem, _ = os.path.splitext(frame)
-            x = pil_loader(os.path.join(self.root, frame))
-            self.tensors.append(self.xform(x))
-            self.stems.append(stem)
+        self.store = SeekableVideo(self.root, resize) if is_video_file(self.root) else FrameStore(self.root, resize)
+        self.frames = self.store.frames
+        self.stems = [os.path.splitext(frame)[0] for frame in self.frames]
 
     def __len__(self):
-        return len(self.tensors)
+        return len(self.store)
 
     def __getitem__(self, idx):
-        return self.stems[idx], self.tensors[idx]
+        return self.stems[idx], self.store[idx]
+
+
+def augment_items(transform, items):
+    # PIL images one by one, same-sized tensors (in [0, 1]) as a single batch on their device
+    if all(torch.is_tensor(item) for item in items) and len(set(item.shape for item in items)) == 1:
+        return list(transform(torch.stack(items)).unbind(0))
+    return [transform(item) for item in items]
 
 
 class NullAugmentations:
@@ -298,10 +248,7 @@ class ShapeAugmentations:
             x = Tfunc.rotate(x, angle)
             return x
 
-        augmented_items = []
-        for item in items:
-            augmented_items.append(transform(item))
-        return augmented_items
+        return augment_items(transform, items)
 
 
 class ColorAugmentations:
@@ -328,17 +275,15 @@ class ColorAugmentations:
             x = Tfunc.adjust_saturation(x, sat)
             return x
 
-        augmented_items = []
-        for item in items:
-            augmented_items.append(transform(item))
-        return augmented_items
+        return augment_items(transform, items)
 
 
 class TrainingDataset(Dataset):
-    def __init__(self, frames_dir, keyframe_dir, xform, data_aux, disable_augment=False):
+    def __init__(self, frames_dir, keyframe_dir, xform, data_aux, disable_augment=False, device=None):
         self.frames_dir = frames_dir
         self.keyframe_dir = keyframe_dir
         self.xform = xform
+        self.device = device
 
         keys_in = [f for f in images_in_directory(self.keyframe_dir)]
         keys_out = [f for f in images_in_directory(self.keyframe_dir)]
@@ -349,35 +294,49 @@ class TrainingDataset(Dataset):
         self.aux_data = data_aux
         self.pairs = []
         self.stems = []
+        # with a video as frames_dir, keyframes are named by their frame number
+        video = SeekableVideo(self.frames_dir) if is_video_file(self.frames_dir) else None
         for keyframe in self.keypair_files:
             key_in, key_out = keyframe
             stem, _ = os.path.splitext(key_in)
-            keyframe_in = pil_loader(os.path.join(self.frames_dir, key_in))
+            if video is not None:
+                keyframe_in = video.image(int(stem))
+            else:
+                keyframe_in = pil_loader(os.path.join(self.frames_dir, key_in))
             keyframe_out = pil_loader(os.path.join(self.keyframe_dir, key_out))
             self.pairs.append((keyframe_in, keyframe_out))
             self.stems.append(stem)
         self.shape_augment = ShapeAugmentations() if not disable_augment else NullAugmentations()
         self.color_augment = ColorAugmentations()
+        self.tensors = {}
+        self.digests = {}
 
     def __len__(self):
         return len(self.pairs)
 
+    def keyframe_tensors(self, idx):
+        # xform runs once per keyframe pair, the result stays on the device
+        if idx not in self.tensors:
+            self.tensors[idx] = tuple(self.xform(x).to(self.device) for x in self.pairs[idx])
+            # content hash of the style keyframe, keys its Gram targets in the style loss
+            self.digests[self.stems[idx]] = tensor_digest(self.tensors[idx][1])
+        return self.tensors[idx]
+
     def __getitem__(self, idx):
         # choose a random sample from the dataset, different on each call, along with the original keyframe
-
-        shaped0, shaped1 = self.shape_augment(self.pairs[idx][0], self.pairs[idx][1])
+        pure_x, pure_y = self.keyframe_tensors(idx)
+        # the augmentations see [0, 1] images like ToTensor output, so rotation fills with black as it did on PIL
+        shaped0, shaped1 = self.shape_augment(pure_x * 0.5 + 0.5, pure_y * 0.5 + 0.5)
         colored0, = self.color_augment(shaped0)
 
-        return self.stems[idx], self.xform(colored0), self.xform(shaped1), self.xform(self.pairs[idx][0]), self.xform(
-            self.pairs[idx][1])
-        # return self.pairs[idx][0], self.pairs[idx][1]
+        return self.stems[idx], colored0 * 2 - 1, shaped1 * 2 - 1, pure_x, pure_y
 
 
 def log_verification_images(config, log, step, model, dataset, transform, additional_image=None):
     with torch.no_grad():
         model.eval()
         idx, example = enumerate(dataset).__next__()
-        f = example[1].to(guess_model_device(model))
+        f = normalize_frames(example[1].to(guess_model_device(model)))
         if config['model_params']['input_channels'] == 4:
             ones = th.ones_like(f[:, :1], device=device)
             f = th.cat([ones, f], dim=1)
@@ -398,7 +357,7 @@ def log_verification_video(config, log, step, label, model, dataset, transform,
             _, b = batch
             if max_frames is not None and i >= max_frames: break
             if len(b.shape) == 3: b = b.unsqueeze(0)
-            b = tensor_resample(b.to(device), [shape[2], shape[3]])
+            b = tensor_resample(normalize_frames(b.to(device)), [shape[2], shape[3]])
             frame = model(b)
             for j in range(frame.shape[0]):
                 vid_tensor[:, i, :, :, :] = transform.denormalize_tensor(frame[j:j + 1])
@@ -494,21 +453,9 @@ class PatchSampler:
         coords = self._positions[self._ptr : self._ptr + self.num_patches]
         self._ptr += self.num_patches
 
-        outputs = []
-        for img in images:
-            # for each (y,x), slice out img[..., y:y+ps, x:x+ps]
-            # stack them along a new axis=2 → (B, C, num_patches, ps, ps)
-            stacked = torch.stack([
-                img[..., y : y + self.ps, x : x + self.ps]
-                for (y, x) in coords
-            ], dim=2)
-
-            # flatten batch & patch dims → (B * num_patches, C, ps, ps)
-            patches = rearrange(stacked, 'b c n k1 k2 -> (b n) c k1 k2')
-
-            outputs.append(patches)
-
-        return outputs
+        # img[..., y:y+ps, x:x+ps] for every (y,x) and every image in one gather,
+        # flattened batch-major → (B * num_patches, C, ps, ps)
+        return gather_patches(images, coords[:, 0], coords[:, 1], self.ps)
 
 
 import bisect
@@ -599,6 +546,8 @@ def train(config, model, iters, key_weight, style_weight, structure_weight, data
         model.train()
         np.random.seed(epoch)
 
+        # host time spent producing a batch, keyframes and auxiliary frame, reported as data_time
+        data_begin = time.perf_counter()
         with suppress():
             for batch_idx, batch in enumerate(dataset_train):
                 error, style_loss, key_loss, structure_loss = 0, 0, 0, 0
@@ -608,12 +557,12 @@ def train(config, model, iters, key_weight, style_weight, structure_weight, data
 
                 _, aux_batch = aux_sample()
                 stems, frame_x = aux_batch
+                frame_x = normalize_frames(frame_x.to(device))
+                data_time = time.perf_counter() - data_begin
 
                 control_image_0_1 = control_processor(key_stems, stems, frame_x, keyframe_x, keyframe_y)
                 control_image_0_1 = control_image_0_1.to(device)
 
-                frame_x = frame_x.to(device)
-
                 pure_y_full = pure_y.clone()
                 if config.use_patches:
                     keyframe_x, keyframe_y, pure_x, pure_y = \
@@ -631,7 +580,9 @@ def train(config, model, iters, key_weight, style_weight, structure_weight, data
                     frame_y = model(frame_x.clone())
 
                 with suppress():
-                    style_loss = style_weight * similarity_loss(frame_y, pure_y_full, cache_y2=True)
+                    style_loss = style_weight * similarity_loss(frame_y, pure_y_full, cache_y2=True,
+                                                                keys=[dataset_train.dataset.digests[stem]
+                                                                      for stem in key_stems])
                     structure_loss = structure_weight * guidance_sd.train_step(frame_y / 2.0 + 0.5,
                                                                                control_image_0_1,
                                                                                epoch=epoch,
@@ -640,7 +591,7 @@ def train(config, model, iters, key_weight, style_weight, structure_weight, data
                 # Track values for logging
                 error = style_loss + structure_loss + key_loss
 
-                tracked_scalars = ['image_error', 'similarity_error', 'sds_loss', 'error']
+                tracked_scalars = ['image_error', 'similarity_error', 'sds_loss', 'error', 'data_time']
                 scalars = {name: value for name, value in locals().items() if name in tracked_scalars}
                 log.log_multiple_scalars(scalars, epoch)
 
@@ -651,7 +602,9 @@ def train(config, model, iters, key_weight, style_weight, structure_weight, data
                                     'key': f'{key_loss:0.5f}',
                                     'sty': f'{style_loss:0.5f}',
                                     'str': f'{structure_loss:0.5f}',
+                                    'data': f'{1000 * data_time:.1f}ms',
                                     })
+                data_begin = time.perf_counter()
 
             # Take snapshots
             for deadline, snap in snapshots:
@@ -782,8 +735,7 @@ if __name__ == "__main__":
         data_root_valid = os.path.join(config['key_frames_dir'], 'valid')
 
     # probe size
-    data_aux_probe = InferDataset(frames_dir, lambda x: x)
-    data_train_probe = TrainingDataset(frames_dir, key_frames_dir, lambda x: x, data_aux_probe,
+    data_train_probe = TrainingDataset(frames_dir, key_frames_dir, lambda x: x, None,
                                        disable_augment=config['disable_augment'])
 
     size = None
@@ -794,24 +746,29 @@ if __name__ == "__main__":
             print("WARNING: One of the input images has different size.")
         if y.size != size:
             print("WARNING: One of the output images has different size")
-    for im in data_aux_probe.tensors:
-        if im.size != size:
-            print("WARNING: One of the video frames has different size")
+    if is_video_file(frames_dir):
+        video = SeekableVideo(frames_dir)
+        if (video.width, video.height) != size:
+            print("WARNING: The video frames have different size")
+    else:
+        for frame in images_in_directory(frames_dir):
+            # opening only parses the header, the frames are not decoded
+            with Image.open(os.path.join(frames_dir, frame)) as im:
+                if im.size != size:
+                    print("WARNING: One of the video frames has different size")
 
-    del data_aux_probe
     del data_train_probe
 
     device = config['device']
     storage_to_cpu = False
-    transform = ImageTensorConverter(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5],
-                                     resize=f'flex;8;max;{config["resize"]}' if config["resize"] is not None else f'flex;8',
-                                     drop_alpha=True)
+    resize = f'flex;8;max;{config["resize"]}' if config["resize"] is not None else f'flex;8'
+    transform = ImageTensorConverter(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5], resize=resize, drop_alpha=True)
     model = ImageToImageGenerator_JohnsonFutschik(config=config, **config['model_params'])
 
-    data_aux = InferDataset(frames_dir, transform)
+    data_aux = InferDataset(frames_dir, resize)
     data_train = TrainingDataset(frames_dir, key_frames_dir, transform, data_aux,
-                                 disable_augment=config['disable_augment'])
-    data_validate = InferDataset(data_root_valid, transform) if data_root_valid is not None else None
+                                 disable_augment=config['disable_augment'], device=device)
+    data_validate = InferDataset(data_root_valid, resize) if data_root_valid is not None else None
 
 
     def worker_init_fn(worker_id):
@@ -835,7 +792,14 @@ if __name__ == "__main__":
 
     sampler = PatchSampler(config.patch_size, config.num_patches)
 
-    similarity_loss = InnerProductLoss(layers, device)
+    style_scales = config['style_scales'] if 'style_scales' in config else [1.0]
+    parent, name = os.path.split(os.path.abspath(key_frames_dir))
+    similarity_loss = InnerProductLoss(layers, device, scales=style_scales,
+                                       cache_dir=os.path.join(parent, f'.{name}.grams'))
+    # Gram targets of every keyframe at every scale, loaded from disk when an earlier run computed them
+    for idx in range(len(data_train)):
+        _, pure_y = data_train.keyframe_tensors(idx)
+        similarity_loss.precompute(data_train.digests[data_train.stems[idx]], pure_y.unsqueeze(0))
 
     guidance_sd, processor = prepare_cldm(config)
 